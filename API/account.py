@@ -4,6 +4,15 @@ from database import database
 
 class Account(database.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # keyset pagination order (see AccountController.get_accounts)
+        database.Index('ix_users_created_at_account_id', 'created_at', 'account_id'),
+        # trigram indexes so ilike('%...%') searches don't scan the table (needs pg_trgm)
+        database.Index('ix_users_name_trgm', 'name', postgresql_using='gin',
+                       postgresql_ops={'name': 'gin_trgm_ops'}),
+        database.Index('ix_users_email_trgm', 'email', postgresql_using='gin',
+                       postgresql_ops={'email': 'gin_trgm_ops'}),
+    )
 
     # we found that sqlalchemy already has a super init
     account_id = database.Column(database.Integer, primary_key=True, autoincrement=True)
@@ -11,7 +20,7 @@ class Account(database.Model):
     email = database.Column(database.String(100), unique=True, nullable=False)
     password = database.Column(database.String(255), nullable=False)
     role = database.Column(database.String(50), nullable=False)
-    created_at = database.Column(database.DateTime, nullable=True, default=func.now())
+    created_at = database.Column(database.DateTime, nullable=False, default=func.now())
     status = database.Column(database.Enum('Active', 'Banned', 'Suspended'), nullable=False, default="Active")
 
     def get_user_details(self):
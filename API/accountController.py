@@ -1,7 +1,15 @@
 from account import Account
 from database import database
-from sqlalchemy import func
-import bcrypt
+from sqlalchemy import func, tuple_
+from datetime import datetime
+import base64
+import json
+from password_hasher import hash_password, check_password, PasswordHasherBusy
+
+
+class InvalidCursor(ValueError):
+    def __init__(self, cursor):
+        super().__init__(f"Invalid cursor: {cursor}")
 
 
 class AccountController:
@@ -19,13 +27,19 @@ class AccountController:
             return None
 
     # method to get accounts
+    # keyset=True (or a cursor from the previous page's next_cursor) pages by (created_at, account_id),
+    # which costs the same at any depth; page/offset paging is kept for old callers.
     @staticmethod
-    def get_accounts(page=1, limit=15, query=None):
+    def get_accounts(page=1, limit=15, query=None, cursor=None, keyset=False):
         try:
             if query is None:
                 query = Account.query
+            query = query.order_by(Account.created_at, Account.account_id)
+
             if limit is None:
                 accounts = query.all()
+            elif keyset or cursor is not None:
+                return AccountController._get_accounts_after(query, cursor, limit)
             else:
                 offset = (page - 1) * limit
                 accounts = query.offset(offset).limit(limit).all()
@@ -34,10 +48,44 @@ class AccountController:
                 "accounts": [account.get_user_details() for account in accounts],
                 "count": len(accounts)
             }
+        except InvalidCursor:
+            raise
         except Exception as e:
             print(f"Error getting accounts: {e}")
             return None
 
+    @staticmethod
+    def _get_accounts_after(query, cursor, limit):
+        if cursor:
+            created_at, account_id = AccountController._decode_cursor(cursor)
+            # seek straight to the cursor through ix_users_created_at_account_id
+            query = query.filter(tuple_(Account.created_at, Account.account_id) > (created_at, account_id))
+
+        # one extra row tells us whether there's a next page without counting
+        accounts = query.limit(limit + 1).all()
+        has_more = len(accounts) > limit
+        accounts = accounts[:limit]
+        return {
+            "success": True,
+            "accounts": [account.get_user_details() for account in accounts],
+            "count": len(accounts),
+            "next_cursor": AccountController._encode_cursor(accounts[-1]) if has_more and accounts else None
+        }
+
+    # cursors are opaque to clients: base64 of the last row's (created_at, account_id)
+    @staticmethod
+    def _encode_cursor(account):
+        raw = json.dumps([account.created_at.isoformat(), account.account_id])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            created_at, account_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return datetime.fromisoformat(created_at), int(account_id)
+        except (ValueError, TypeError) as e:
+            raise InvalidCursor(cursor) from e
+
     # legacy method (reworked to filter_account)
     # @staticmethod
     # def get_status_filter(status_filter):
@@ -48,7 +96,7 @@ class AccountController:
 
     @staticmethod
     def filter_account(name=None, email=None, role=None, created_start=None, created_end=None, status=None,
-                       page=1, limit=15):
+                       page=1, limit=15, cursor=None, keyset=False):
         try:
             query = Account.query
             if name:
@@ -62,7 +110,9 @@ class AccountController:
             if status:
                 query = query.filter_by(status=status)
 
-            return AccountController.get_accounts(page=page, limit=limit, query=query)
+            return AccountController.get_accounts(page=page, limit=limit, query=query, cursor=cursor, keyset=keyset)
+        except InvalidCursor:
+            raise
         except Exception as e:
             print(f"Error filtering account: {e}")
             return None
@@ -77,11 +127,10 @@ class AccountController:
             if exists:
                 return False
 
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
             new_account = Account(
                 name=name,
                 email=email,
-                password=hashed_password.decode('utf-8'),
+                password=hash_password(password),
                 role=role,
                 created_at=func.now(),
                 status="Active"
@@ -89,6 +138,9 @@ class AccountController:
             database.session.add(new_account)
             database.session.commit()
             return True
+        except PasswordHasherBusy:
+            database.session.rollback()
+            raise
         except Exception as e:
             database.session.rollback()
             print(f"Error creating account: {e}")
@@ -115,8 +167,7 @@ class AccountController:
                 return False, None
 
             if password is not None:
-                hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-                account.password = hashed.decode('utf-8')
+                account.password = hash_password(password)
 
             change = {
                 "name": name,
@@ -131,6 +182,9 @@ class AccountController:
 
             database.session.commit()
             return True, change.items()
+        except PasswordHasherBusy:
+            database.session.rollback()
+            raise
         except Exception as e:
             database.session.rollback()
             print(f"Error editing account: {e}")
@@ -161,7 +215,7 @@ class AccountController:
             if not user:
                 return {"success": False, "message": "Email not found"}
 
-            if bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
+            if check_password(password, user.password):
                 return {
                     "success": True,
                     "user_id": user.account_id,
@@ -172,6 +226,8 @@ class AccountController:
                 }
 
             return {"success": False, "message": "Incorrect password"}
+        except PasswordHasherBusy:
+            raise
         except Exception as e:
             print(f"Error during login: {e}")
             return {"success": False, "message": "Login failed"}
@@ -186,15 +242,17 @@ class AccountController:
 
             # Verify old password
             if old_password is not None:
-                if not bcrypt.checkpw(old_password.encode('utf-8'), account.password.encode('utf-8')):
+                if not check_password(old_password, account.password):
                     return False, "Incorrect old password"
 
             # Hash and set new password
-            hashed = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-            account.password = hashed.decode('utf-8')
+            account.password = hash_password(new_password)
 
             database.session.commit()
             return True, "Password changed successfully"
+        except PasswordHasherBusy:
+            database.session.rollback()
+            raise
         except Exception as e:
             database.session.rollback()
             print(f"Error changing password: {e}")
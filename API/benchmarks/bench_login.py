@@ -0,0 +1,66 @@
+"""
+Login throughput vs. bcrypt worker count.
+
+Runs the password check behind AccountController.login from many concurrent "request"
+threads, once per BCRYPT_WORKERS value, and prints logins/s plus how many were shed (503).
+
+    cd API
+    python benchmarks/bench_login.py --requests 200 --clients 64 --rounds 12
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_once(requests, clients, rounds):
+    sys.path.insert(0, API_DIR)
+    import bcrypt
+    from password_hasher import check_password, PasswordHasherBusy
+
+    hashed = bcrypt.hashpw(b"correct horse", bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+    def login(_):
+        try:
+            return check_password("correct horse", hashed)
+        except PasswordHasherBusy:
+            return None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(login, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    served = sum(1 for r in results if r is not None)
+    print(f"{os.environ['BCRYPT_WORKERS']:>7} {served / elapsed:>9.1f} {served:>7} {requests - served:>6} {elapsed:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=64, help="concurrent login requests")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_once(args.requests, args.clients, args.rounds)
+        return
+
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, 16, cores} & set(range(1, cores + 1)))
+    print(f"{cores} cores, {args.requests} logins from {args.clients} clients, cost {args.rounds}")
+    print("workers  logins/s  served   shed  seconds")
+    for workers in worker_counts:
+        # the pool is sized at import time, so every worker count gets a fresh interpreter
+        env = dict(os.environ, BCRYPT_WORKERS=str(workers), BCRYPT_ROUNDS=str(args.rounds))
+        subprocess.run([sys.executable, __file__, "--child", "--requests", str(args.requests),
+                        "--clients", str(args.clients), "--rounds", str(args.rounds)], env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
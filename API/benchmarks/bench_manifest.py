@@ -0,0 +1,107 @@
+"""
+Download manifest latency vs. table size.
+
+Fills files / file_shards / file_keys with synthetic rows (n shards + m key shares per file) and
+times load_manifest() for random files at each size. --no-indexes creates the tables without the
+file_id indexes, to compare against the old sequential-scan behaviour.
+
+    cd API
+    python benchmarks/bench_manifest.py --db postgresql://... --sizes 1000 10000 100000
+    python benchmarks/bench_manifest.py                     # throwaway SQLite database
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert
+from database import database
+from files import File
+from file_shards import FileShard
+from file_keys import FileKey
+from storage import Storage
+from file_manifest import load_manifest
+
+BATCH = 1000  # files inserted per statement batch
+
+
+def populate(count, n, m, storage_ids):
+    file_ids = []
+    for start in range(0, count, BATCH):
+        batch = [uuid.uuid4() for _ in range(min(BATCH, count - start))]
+        database.session.execute(insert(File), [
+            {"file_id": fid, "filename": "bench.bin", "group_id": 1, "account_id": 1, "shard_count": n,
+             "required_shards": n // 2 + 1, "original_length": 1024, "key_threshold": m // 2 + 1,
+             "format_version": 2, "segment_size": 4 * 1024 * 1024, "segment_count": 1}
+            for fid in batch
+        ])
+        database.session.execute(insert(FileShard), [
+            {"file_id": fid, "shard_index": i, "storage_id": storage_ids[i % len(storage_ids)],
+             "shard_file_id": uuid.uuid4().hex, "folder_id": "", "shard_size": 400, "block_size": 400}
+            for fid in batch for i in range(n)
+        ])
+        database.session.execute(insert(FileKey), [
+            {"file_id": fid, "storage_id": storage_ids[i % len(storage_ids)], "key_file_id": uuid.uuid4().hex}
+            for fid in batch for i in range(m)
+        ])
+        database.session.commit()
+        file_ids += batch
+    return file_ids
+
+
+def measure(file_ids, samples):
+    timings = []
+    for fid in random.sample(file_ids, min(samples, len(file_ids))):
+        started = time.perf_counter()
+        load_manifest(fid)
+        timings.append((time.perf_counter() - started) * 1000)
+        database.session.rollback()  # don't let the identity map answer the next lookup
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="SQLAlchemy URL (default: temporary SQLite file); tables are dropped!")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="file counts")
+    parser.add_argument("-n", type=int, default=5, help="shards per file")
+    parser.add_argument("-m", type=int, default=4, help="key shares per file")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--no-indexes", action="store_true")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    database.init_app(app)
+
+    if args.no_indexes:
+        shard_table, key_table = FileShard.__table__, FileKey.__table__
+        shard_table.constraints = {c for c in shard_table.constraints
+                                   if c.name != "uq_file_shards_file_id_shard_index"}
+        key_table.indexes = {i for i in key_table.indexes if i.name != "ix_file_keys_file_id"}
+
+    with app.app_context():
+        database.drop_all()
+        database.create_all()
+        storages = [Storage(group_id=1, account_id=1, storage_type="memory") for _ in range(max(args.n, args.m))]
+        database.session.add_all(storages)
+        database.session.commit()
+        storage_ids = [s.storage_id for s in storages]
+
+        print(f"{'files':>8} {'rows':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        file_ids = []
+        for size in sorted(args.sizes):
+            file_ids += populate(size - len(file_ids), args.n, args.m, storage_ids)
+            p50, p99 = measure(file_ids, args.samples)
+            print(f"{size:>8} {size * (args.n + args.m):>9} {p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
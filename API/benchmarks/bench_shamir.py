@@ -0,0 +1,66 @@
+"""
+Key splitting / combining: pycryptodome's Shamir (the old per-file path) vs. shamir_batch.
+
+Splits N 32-byte AES keys into m shares with threshold t, then combines t shares of each,
+and prints keys/s for the old per-file calls, shamir_batch one key at a time (what an upload
+or download does) and shamir_batch in one batch call (bulk import).
+
+    cd API
+    python benchmarks/bench_shamir.py --keys 2000 -t 3 -m 5
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Crypto.Protocol.SecretSharing import Shamir
+from shamir_batch import split_key, combine_key, split_secrets, combine_secrets
+
+
+def old_split(key, t, m):
+    halves = Shamir.split(t, m, key[:16]), Shamir.split(t, m, key[16:])
+    return [(a[0], a[1] + b[1]) for a, b in zip(*halves)]
+
+
+def old_combine(shares):
+    return (Shamir.combine([(i, s[:16]) for i, s in shares]) +
+            Shamir.combine([(i, s[16:]) for i, s in shares]))
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=2000)
+    parser.add_argument("-t", type=int, default=3, help="threshold")
+    parser.add_argument("-m", type=int, default=5, help="shares per key")
+    args = parser.parse_args()
+    keys = [os.urandom(32) for _ in range(args.keys)]
+    t, m = args.t, args.m
+
+    runs = {
+        "pycryptodome per key": (lambda: [old_split(key, t, m) for key in keys],
+                                 lambda shares: [old_combine(s[:t]) for s in shares]),
+        "shamir_batch per key": (lambda: [split_key(key, t, m) for key in keys],
+                                 lambda shares: [combine_key(s[:t]) for s in shares]),
+        "shamir_batch batched": (lambda: split_secrets(keys, t, m),
+                                 lambda shares: combine_secrets([s[:t] for s in shares])),
+    }
+
+    print(f"{args.keys} keys, t={t}, m={m}")
+    print(f"{'':<22} {'split keys/s':>13} {'combine keys/s':>15}")
+    for name, (split, combine) in runs.items():
+        shares, split_time = timed(split)
+        combined, combine_time = timed(lambda: combine(shares))
+        assert combined == keys, f"{name}: round trip failed"
+        print(f"{name:<22} {args.keys / split_time:>13.0f} {args.keys / combine_time:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import segment_codec
+import segment_compression
+
+# where segment encryption + erasure coding runs:
+#   inline  - in the request thread (default)
+#   thread  - shared thread pool
+#   process - shared process pool; segments are handed over through shared memory
+CODEC_EXECUTOR = os.environ.get("CODEC_EXECUTOR", "inline")
+CODEC_WORKERS = int(os.environ.get("CODEC_WORKERS", os.cpu_count() or 1))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if CODEC_EXECUTOR == "process":
+                # spawn: forking a process full of request threads isn't safe
+                _executor = ProcessPoolExecutor(max_workers=CODEC_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _executor = ThreadPoolExecutor(max_workers=CODEC_WORKERS, thread_name_prefix="codec")
+        return _executor
+
+
+def _attach(name):
+    # spawned workers share the parent's resource tracker, and the parent unlinks every block
+    return shared_memory.SharedMemory(name=name)
+
+
+def _encode_in_worker(key, k, n, index, is_last, compression, in_name, in_length, out_name):
+    source = _attach(in_name)
+    target = _attach(out_name)
+    try:
+        plaintext = bytes(source.buf[:in_length])
+        blocks, payload_length = segment_codec.encode_segment(key, k, n, index, is_last, plaintext, compression)
+        size = len(blocks[0])
+        for j, block in enumerate(blocks):
+            target.buf[j * size:(j + 1) * size] = block
+        return size, payload_length
+    finally:
+        source.close()
+        target.close()
+
+
+def _decode_in_worker(key, k, n, index, is_last, blob_length, codec, plain_length, block_numbers, block_size,
+                      in_name, out_name):
+    source = _attach(in_name)
+    target = _attach(out_name)
+    try:
+        blocks = [bytes(source.buf[j * block_size:(j + 1) * block_size]) for j in range(k)]
+        blob = segment_codec.decode_blob(blocks, block_numbers, k, n, blob_length)
+        plaintext = segment_codec.decrypt_segment(AESGCM(key), index, is_last, blob)
+        if codec is not None:
+            plaintext = segment_compression.unpack_segment(codec, plaintext, plain_length)
+        target.buf[:len(plaintext)] = plaintext
+    finally:
+        source.close()
+        target.close()
+
+
+def _shared_block(size):
+    # SharedMemory can't be zero sized
+    return shared_memory.SharedMemory(create=True, size=max(1, size))
+
+
+def _free(*blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def encode_segment(key, k, n, index, is_last, plaintext, compression=None):
+    """(Compress,) encrypt and erasure code one plaintext segment; returns (n blocks, payload length)."""
+    if CODEC_EXECUTOR == "inline":
+        return segment_codec.encode_segment(key, k, n, index, is_last, plaintext, compression)
+
+    if CODEC_EXECUTOR == "thread":
+        return _get_executor().submit(segment_codec.encode_segment, key, k, n, index, is_last, plaintext,
+                                      compression).result()
+
+    # worst case: the segment didn't compress and got stored with its flag byte
+    max_payload = len(plaintext) + (1 if compression else 0)
+    max_block_size = (max_payload + segment_codec.SEGMENT_OVERHEAD + k - 1) // k
+    source = _shared_block(len(plaintext))
+    target = _shared_block(max_block_size * n)
+    try:
+        source.buf[:len(plaintext)] = plaintext
+        block_size, payload_length = _get_executor().submit(
+            _encode_in_worker, key, k, n, index, is_last, compression, source.name, len(plaintext), target.name
+        ).result()
+        return [bytes(target.buf[j * block_size:(j + 1) * block_size]) for j in range(n)], payload_length
+    finally:
+        _free(source, target)
+
+
+def decode_segment(key, layout, index, blocks, block_numbers, n, codec=None):
+    """Rebuild, decrypt (and decompress) one segment from k of its blocks."""
+    if CODEC_EXECUTOR == "inline":
+        return segment_codec.decode_segment(AESGCM(key), layout, index, blocks, block_numbers, n, codec)
+
+    if CODEC_EXECUTOR == "thread":
+        return _get_executor().submit(
+            segment_codec.decode_segment, AESGCM(key), layout, index, blocks, block_numbers, n, codec
+        ).result()
+
+    block_size = layout.block_size(index)
+    plain_length = layout.plain_length(index)
+    source = _shared_block(block_size * layout.k)
+    target = _shared_block(plain_length)
+    try:
+        for j, block in enumerate(blocks):
+            source.buf[j * block_size:(j + 1) * block_size] = block
+        _get_executor().submit(_decode_in_worker, key, layout.k, n, index, index == layout.segment_count - 1,
+                               layout.blob_length(index), codec, plain_length, list(block_numbers), block_size,
+                               source.name, target.name).result()
+        return bytes(target.buf[:plain_length])
+    finally:
+        _free(source, target)
@@ -0,0 +1,115 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from googleapiclient.discovery import build
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from database import database
+from storage import Storage
+
+# treat a token as stale this many seconds before it actually expires
+REFRESH_MARGIN = int(os.environ.get("CREDENTIAL_REFRESH_MARGIN", 300))
+# how long to keep credentials whose expiry we don't know
+DEFAULT_TTL = int(os.environ.get("CREDENTIAL_DEFAULT_TTL", 1800))
+
+_entries = {}  # storage_id -> (creds, cached_until)
+_locks = {}  # storage_id -> lock, so only one load/refresh runs per storage
+_locks_guard = threading.Lock()
+_pending_tokens = {}  # storage_id -> (token, expiry) waiting to be written back
+_pending_guard = threading.Lock()
+# googleapiclient services wrap an httplib2 connection that isn't thread-safe,
+# so every worker thread keeps its own service per storage
+_thread_services = threading.local()
+
+
+def _lock_for(storage_id):
+    with _locks_guard:
+        return _locks.setdefault(storage_id, threading.Lock())
+
+
+def _cached_until(creds):
+    if creds.expiry:
+        return creds.expiry - timedelta(seconds=REFRESH_MARGIN)
+    return datetime.utcnow() + timedelta(seconds=DEFAULT_TTL)
+
+
+def get_credentials(storage_id, loader):
+    """
+    Cached credentials for a storage. loader(storage_id) builds (and refreshes if needed)
+    the credentials on a miss; it runs at most once at a time per storage.
+    """
+    entry = _entries.get(storage_id)
+    if entry and entry[1] > datetime.utcnow():
+        return entry[0]
+
+    with _lock_for(storage_id):
+        # someone else may have loaded it while we waited for the lock
+        entry = _entries.get(storage_id)
+        if entry and entry[1] > datetime.utcnow():
+            return entry[0]
+
+        creds = loader(storage_id)
+        if creds is None:
+            _entries.pop(storage_id, None)
+            return None
+        _entries[storage_id] = (creds, _cached_until(creds))
+        return creds
+
+
+def put_credentials(storage_id, creds):
+    """Store freshly refreshed credentials and queue the new token to be persisted."""
+    _entries[storage_id] = (creds, _cached_until(creds))
+    queue_token(storage_id, creds)
+
+
+def get_drive_service(storage_id, loader):
+    creds = get_credentials(storage_id, loader)
+    if creds is None:
+        return None
+
+    services = getattr(_thread_services, "services", None)
+    if services is None:
+        services = _thread_services.services = {}
+
+    cached = services.get(storage_id)
+    if cached and cached[0] is creds:
+        return cached[1]
+
+    # discovery build is slow; only redo it when the credentials object changed
+    service = build("drive", "v3", credentials=creds, cache_discovery=False)
+    services[storage_id] = (creds, service)
+    return service
+
+
+def invalidate(storage_id):
+    _entries.pop(storage_id, None)
+
+
+def queue_token(storage_id, creds):
+    with _pending_guard:
+        _pending_tokens[storage_id] = (creds.token, creds.expiry)
+
+
+def flush_tokens():
+    """Write every queued token back to the storage table in one batch."""
+    with _pending_guard:
+        pending = dict(_pending_tokens)
+        _pending_tokens.clear()
+    if not pending:
+        return
+
+    rows = [
+        {"storage_id": storage_id, "token": token, "token_expiry": expiry}
+        for storage_id, (token, expiry) in pending.items()
+    ]
+    # own session so we never commit half-finished work from the request's session
+    with Session(database.engine) as session:
+        try:
+            session.execute(update(Storage), rows)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"Error saving refreshed tokens: {e}")
+            with _pending_guard:
+                for storage_id, token in pending.items():
+                    _pending_tokens.setdefault(storage_id, token)
@@ -1,3 +1,25 @@
+import os
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
-database = SQLAlchemy()
\ No newline at end of file
+database = SQLAlchemy()
+
+# connection pool settings (app.py passes these as SQLALCHEMY_ENGINE_OPTIONS)
+ENGINE_OPTIONS = {
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+    "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),  # seconds to wait for a free connection
+    # the hosted pooler drops idle connections; recycle ours before it does and test them on checkout
+    "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 300)),
+    "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true"),
+}
+STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 30000))  # ms, 0 disables
+
+
+@event.listens_for(Engine, "begin")
+def _set_statement_timeout(conn):
+    # SET LOCAL lasts for the transaction only, so it also works behind a transaction-mode pooler
+    # (which rejects per-connection startup options)
+    if STATEMENT_TIMEOUT and conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT}")
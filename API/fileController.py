@@ -1,116 +1,206 @@
+import hashlib
 import json
 import struct
-from flask import request, jsonify, send_file
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from googleapiclient.http import MediaIoBaseDownload
+from flask import request, jsonify, Response, stream_with_context
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from zfec.easyfec import Encoder, Decoder
-from io import BytesIO
+from zfec.easyfec import Decoder
 import os
-from storageController import StorageController
+import re
+import tempfile
+from datetime import datetime
+from urllib.parse import quote
+from sqlalchemy import insert, select, update
+from uuid import UUID, uuid4
+from storage_backends import get_backend
 from files import File
 from file_shards import FileShard
 from file_keys import FileKey
+from storage import Storage, READABLE_STATUSES
 from database import database
-from Crypto.Protocol.SecretSharing import Shamir
+from shamir_batch import split_key, combine_key
 from Crypto.Random import get_random_bytes
+from transfer_pool import run_all, first_k, submit, TransferError
+from file_manifest import get_manifest, load_manifest, invalidate
+from upload_jobs import UploadJob, UploadJobs
+from upload_sessions import UploadSessions, OffsetMismatch
+from segment_codec import SegmentEncoder, SegmentLayout, FORMAT_SEGMENTED, pack_lengths, verify_blocks, decode_blob, \
+    open_blob
+from groupController import GroupController
+import codec_executor
+import placement
+import segment_cache
+from zip_stream import ZipEntry, stream_zip
+
+SEGMENTS_PER_FETCH = int(os.environ.get("SEGMENTS_PER_FETCH", 4))  # segments fetched per shard request on download
+ZIP_MAX_FILES = int(os.environ.get("ZIP_MAX_FILES", 10000))  # files per archive download
+# batch uploads: files up to PACK_MAX_FILE_SIZE share containers of up to PACK_CONTAINER_SIZE bytes
+PACK_MAX_FILE_SIZE = int(os.environ.get("PACK_MAX_FILE_SIZE", 1024 * 1024))
+PACK_CONTAINER_SIZE = int(os.environ.get("PACK_CONTAINER_SIZE", 64 * 1024 * 1024))
+# small segments, so reading one packed file only decodes a little around it
+PACK_SEGMENT_SIZE = int(os.environ.get("PACK_SEGMENT_SIZE", 64 * 1024))
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class DownloadError(Exception):
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
 
 
 class FileController:
 
     @staticmethod
-    def upload_google(dest_storage_id, shard, file, i, dest_folder, is_key=False):
-        creds = StorageController.get_google_creds(dest_storage_id)
-        if not creds:
-            raise Exception("Google Drive credentials missing or expired")
-        drive = build("drive", "v3", credentials=creds)
+    def upload_item(dest, new_file, data, index, is_key=False, storage_type=None):
+        dest_folder = dest.get("folder_id") or ""  # only google drive uses folders
+        dest_storage_id = dest["storage_id"]
 
         if is_key:
-            name = f"{file.filename}.key{i}"
+            name = f"{new_file.filename}.key{index}"
         else:
-            name = f"{file.filename}.shard{i}"
+            name = f"{new_file.filename}.shard{index}"
 
-        media = MediaIoBaseUpload(BytesIO(shard), mimetype="application/octet-stream")
-        metadata = {
-            "name": name,
-            "parents": [dest_folder]
-        }
-
-        uploaded = drive.files().create(
-            body=metadata, media_body=media, fields="id"
-        ).execute()
+        # Upload through whichever backend handles this storage's type
+        size = data.seek(0, 2) if hasattr(data, "seek") else len(data)
+        try:
+            with placement.observe(dest_storage_id, size):
+                file_id = get_backend(dest_storage_id, storage_type).put(data, name, dest_folder)
+        except Exception as e:
+            raise Exception(f"Upload to storage {dest_storage_id} failed: {str(e)}")
 
-        return uploaded["id"]
+        # column values for the bulk insert in publish_shards
+        if is_key:
+            return {
+                "file_id": new_file.file_id,
+                "storage_id": dest_storage_id,
+                "key_file_id": file_id
+            }
+        else:
+            return {
+                "file_id": new_file.file_id,
+                "shard_index": index,
+                "storage_id": dest_storage_id,
+                "shard_file_id": file_id,
+                "folder_id": dest_folder,
+                "shard_size": size
+            }
 
     @staticmethod
-    def download_google(storage_id, file_id):
-        creds = StorageController.get_google_creds(storage_id)
-        if not creds:
-            raise Exception("Google Drive credentials missing or expired")
-
-        drive = build("drive", "v3", credentials=creds)
-        download_request = drive.files().get_media(fileId=file_id)
+    def _upload_task(dest, new_file, data, index, is_key=False, progress=None, storage_type=None):
+        def upload():
+            row = FileController.upload_item(dest, new_file, data, index, is_key=is_key, storage_type=storage_type)
+            if progress:
+                progress.object_done("key" if is_key else "shard", index)
+            return row
 
-        buffer = BytesIO()
-        downloader = MediaIoBaseDownload(buffer, download_request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
+        return upload
 
-        return buffer.getvalue()
+    @staticmethod
+    def cleanup_uploaded(rows, storage_types=None):
+        """Best-effort removal of objects that were uploaded before a failure."""
+        storage_types = storage_types or {}
+        FileController.delete_objects([
+            (row["storage_id"], row["key_file_id"] if "key_file_id" in row else row["shard_file_id"],
+             storage_types.get(row["storage_id"]))
+            for row in rows
+        ])
 
     @staticmethod
-    def encrypt(original_bytes):
-        key = AESGCM.generate_key(bit_length=256)
-        aes = AESGCM(key)
-        nonce = os.urandom(12)
-        ciphertext = aes.encrypt(nonce, original_bytes, None)
-        encrypted_data = nonce + ciphertext
+    def _delete_task(storage_id, object_id, storage_type=None):
+        def delete():
+            with placement.observe(storage_id):
+                get_backend(storage_id, storage_type).delete(object_id)
 
-        return key, encrypted_data
+        return delete
 
     @staticmethod
-    def upload_item(dest, new_file, data, file, index, is_key=False):
-        dest_folder = dest["folder_id"]
-        dest_storage_id = dest["storage_id"]
-        dest_type = dest["type"]
-
-        # Upload depending on storage type
-        if dest_type == "google":
+    def delete_objects(objects):
+        """Best-effort, parallel removal of (storage_id, object_id, storage_type) from remote storage."""
+        futures = [
+            (object_id, submit(FileController._delete_task(storage_id, object_id, storage_type)))
+            for storage_id, object_id, storage_type in objects
+        ]
+        for object_id, future in futures:
             try:
-                file_id = FileController.upload_google(
-                    dest_storage_id,
-                    data,
-                    file,
-                    index,
-                    dest_folder,
-                    is_key=is_key
-                )
+                future.result()
             except Exception as e:
-                raise Exception(f"Google upload failed: {str(e)}")
+                print(f"Failed to delete object {object_id}: {e}")
 
-        elif dest_type == "dropbox":
-            raise Exception("Dropbox upload not implemented yet")
+    @staticmethod
+    def parse_upload_form(form, file_size=None):
+        """
+        Validate the upload settings sent with a file; raises UploadError.
+        With placement=auto the server picks the destinations from the group's storages
+        (file_size, if known, lets it skip storages that are running out of space).
+        """
+        # Parse user-specified config
+        try:
+            n = int(form.get("n"))  # reed solomon shards
+            k = int(form.get("k"))  # minimum of reed solomon shards
+            m = int(form.get("m"))  # shamir secret shares
+            t = int(form.get("t"))  # minimum of shamir secret shares
+            group_id = int(form.get("group_id")) if form.get("group_id") else None
 
-        else:
-            raise Exception(f"Invalid storage type: {dest_type}")
+            auto = form.get("placement") == "auto"
+            if not auto:
+                fragment_destinations = json.loads(form.get("fragment_destinations"))
+                key_destinations = json.loads(form.get("key_destinations"))
+                for dest in fragment_destinations + key_destinations:
+                    dest["storage_id"] = int(dest["storage_id"])
+        except Exception as e:
+            raise UploadError(f"Invalid shard destination configuration: {str(e)}", 400)
 
-        if is_key:
-            return FileKey(
-                file_id=new_file.file_id,
-                storage_id=dest_storage_id,
-                key_file_id=file_id
-            )
+        if auto:
+            try:
+                fragment_destinations, key_destinations, storage_types = placement.choose(
+                    group_id, n, k, m, t, file_size)
+            except placement.PlacementError as e:
+                database.session.rollback()
+                raise UploadError(str(e), 400)
+            group_settings = GroupController.upload_settings(group_id)
+            database.session.close()
         else:
-            return FileShard(
-                file_id=new_file.file_id,
-                shard_index=index,
-                storage_id=dest_storage_id,
-                shard_file_id=file_id,
-                folder_id=dest_folder,
-                shard_size=len(data)
-            )
+            # Validate lengths
+            if len(fragment_destinations) != n:
+                raise UploadError(f"fragment_destinations length must be {n}, got {len(fragment_destinations)}", 400)
+
+            if len(key_destinations) != m:
+                raise UploadError(f"fragment_destinations length must be {m}, got {len(key_destinations)}", 400)
+
+            # don't start encoding if a destination can't take uploads anyway
+            dest_ids = {d["storage_id"] for d in fragment_destinations + key_destinations}
+            storages = Storage.query.filter(Storage.storage_id.in_(dest_ids)).all()
+            # the rest of the upload runs without the database: give the connection back to the pool
+            storage_types = {s.storage_id: s.storage_type for s in storages}
+            dead = [f"{s.storage_id} ({s.status})" for s in storages if s.status != "active"]
+            group_settings = GroupController.upload_settings(group_id)
+            database.session.close()
+
+            missing = [str(i) for i in dest_ids if i not in storage_types]
+            if missing:
+                raise UploadError(f"Unknown storage: {', '.join(missing)}", 400)
+            if dead:
+                raise UploadError(f"Storage not accepting uploads: {', '.join(dead)}", 400)
+
+        return {
+            "n": n,
+            "k": k,
+            "m": m,
+            "t": t,
+            "fragment_destinations": fragment_destinations,
+            "key_destinations": key_destinations,
+            "storage_types": storage_types,
+            "compression": group_settings["compression"],
+            "dedup": group_settings["dedup"],
+            "account_id": form.get("account_id"),
+            "group_id": group_id
+        }
 
     @staticmethod
     def upload_file():
@@ -118,236 +208,765 @@ class FileController:
         if not file:
             return jsonify({"error": "No file uploaded"}), 400
 
-        # Parse user-specified config
         try:
-            n = int(request.form.get("n"))  # reed solomon shards
-            k = int(request.form.get("k"))  # minimum of reed solomon shards
-            m = int(request.form.get("m"))  # shamir secret shares
-            t = int(request.form.get("t"))  # minimum of shamir secret shares
+            size = file.stream.seek(0, 2)
+            file.stream.seek(0)
+            params = FileController.parse_upload_form(request.form, size)
+            if request.form.get("async") in ("1", "true"):
+                # spool to disk and let a background worker do the rest
+                job = UploadJobs.submit(file, params, FileController.store_file)
+                return jsonify({
+                    "message": "Upload queued",
+                    "job_id": job.job_id,
+                    "status_url": f"/API/file/upload/status/{job.job_id}"
+                }), 202
+            return jsonify(FileController.store_file(file.stream, file.filename, params))
+        except UploadError as e:
+            return jsonify({"error": e.message}), e.status
+
+    @staticmethod
+    def upload_batch():
+        """
+        Upload several files with one set of settings. Small files are packed together into
+        container files, so they cost one object per shard/key share per container instead of per file.
+        """
+        files = request.files.getlist("files")
+        if not files:
+            return jsonify({"error": "No files uploaded"}), 400
+
+        try:
+            sizes = []
+            for file in files:
+                sizes.append(file.stream.seek(0, 2))
+                file.stream.seek(0)
+            params = FileController.parse_upload_form(request.form, sum(sizes))
+
+            small = []
+            results = []
+            for file, size in zip(files, sizes):
+                if size <= PACK_MAX_FILE_SIZE:
+                    content_hash = None
+                    if params["dedup"]:
+                        content_hash = FileController._hash_stream(file.stream)
+                        summary = FileController.link_duplicate(file.filename, params, content_hash)
+                        if summary:
+                            results.append({"file_id": summary["file_id"], "filename": file.filename,
+                                            "length": size})
+                            continue
+                    small.append((file, size, content_hash))
+                else:
+                    summary = FileController.store_file(file.stream, file.filename, params)
+                    results.append({"file_id": summary["file_id"], "filename": file.filename, "length": size})
+
+            # fill containers in upload order
+            batch, batch_size = [], 0
+            for file, size, content_hash in small:
+                if batch and batch_size + size > PACK_CONTAINER_SIZE:
+                    results += FileController.store_packed(batch, params)["files"]
+                    batch, batch_size = [], 0
+                batch.append((file, content_hash))
+                batch_size += size
+            if batch:
+                results += FileController.store_packed(batch, params)["files"]
+        except UploadError as e:
+            return jsonify({"error": e.message}), e.status
+
+        return jsonify({"message": "Upload successful", "files": results})
+
+    @staticmethod
+    def upload_status(job_id):
+        job = UploadJobs.get(job_id)
+        if not job:
+            return jsonify({"error": "Upload job not found"}), 404
+        return jsonify(job.to_dict())
+
+    @staticmethod
+    def initiate_upload():
+        filename = request.form.get("filename")
+        if not filename:
+            return jsonify({"error": "missing filename"}), 400
 
-            fragment_destinations = json.loads(request.form.get("fragment_destinations"))
-            key_destinations = json.loads(request.form.get("key_destinations"))
+        try:
+            total_size = int(request.form["total_size"]) if request.form.get("total_size") else None
+            params = FileController.parse_upload_form(request.form, total_size)
+            session = UploadSessions.create(filename, params, total_size)
+        except UploadError as e:
+            return jsonify({"error": e.message}), e.status
         except Exception as e:
-            return jsonify({"error": f"Invalid shard destination configuration: {str(e)}"}), 400
+            return jsonify({"error": f"Failed to start upload: {str(e)}"}), 400
+
+        return jsonify({"upload_id": session.upload_id, "offset": 0})
+
+    @staticmethod
+    def upload_chunk(upload_id):
+        session = UploadSessions.get(upload_id)
+        if not session:
+            return jsonify({"error": "Upload not found or expired"}), 404
+
+        try:
+            offset = int(request.args.get("offset", session.received))
+        except ValueError:
+            return jsonify({"error": "offset must be an integer"}), 400
+
+        try:
+            received = session.append(offset, request.stream)
+        except OffsetMismatch as e:
+            # client missed a chunk: tell it where to resume from
+            return jsonify({"error": str(e), "offset": e.expected}), 409
+        except Exception as e:
+            return jsonify({"error": f"Failed to encode chunk: {str(e)}", "offset": session.received}), 500
+
+        return jsonify({"upload_id": upload_id, "offset": received})
+
+    @staticmethod
+    def upload_offset(upload_id):
+        session = UploadSessions.get(upload_id)
+        if not session:
+            return jsonify({"error": "Upload not found or expired"}), 404
+        return jsonify({"upload_id": upload_id, "offset": session.received})
+
+    @staticmethod
+    def finalize_upload(upload_id):
+        session = UploadSessions.get(upload_id)
+        if not session:
+            return jsonify({"error": "Upload not found or expired"}), 404
 
-        # Validate lengths
-        if len(fragment_destinations) != n:
+        if session.total_size is not None and session.received != session.total_size:
             return jsonify({
-                "error": f"fragment_destinations length must be {n}, got {len(fragment_destinations)}"
+                "error": f"Upload incomplete: expected {session.total_size} bytes, got {session.received}",
+                "offset": session.received
             }), 400
 
-        if len(key_destinations) != m:
+        UploadSessions.pop(upload_id)
+        try:
+            layout = session.finish()
+        except Exception as e:
+            session.close()
+            return jsonify({"error": f"Failed to encrypt and encode file: {str(e)}"}), 500
+
+        def publish(progress=None):
+            return FileController.publish_shards(session.filename, session.key, session.params,
+                                                 session.shard_sinks, layout, progress, codec=session.encoder.codec,
+                                                 content_hash=session.encoder.content_hash,
+                                                 checksums=session.encoder.block_checksums)
+
+        if request.args.get("async") in ("1", "true"):
+            job = UploadJob(session.filename, layout.original_length)
+            UploadJobs.queue.submit(job, publish, cleanup=session.close)
             return jsonify({
-                "error": f"fragment_destinations length must be {m}, got {len(key_destinations)}"
-            }), 400
+                "message": "Upload queued",
+                "job_id": job.job_id,
+                "status_url": f"/API/file/upload/status/{job.job_id}"
+            }), 202
 
-        account_id = request.form.get("account_id")
-        group_id = request.form.get("group_id")
+        try:
+            return jsonify(publish())
+        except UploadError as e:
+            return jsonify({"error": e.message}), e.status
+        finally:
+            session.close()
 
-        # AES-GCM encryption
-        original_bytes = file.read()
-        key, encrypted_data = FileController.encrypt(original_bytes)
+    @staticmethod
+    def store_file(stream, filename, params, progress=None):
+        """
+        Encrypt, erasure code and upload a file read from stream; returns the upload summary.
+        Runs in a request or in a background job (progress receives the job's updates).
+        Raises UploadError on failure, after cleaning up anything that was uploaded.
+        """
+        n = params["n"]
+        if params.get("dedup") and stream.seekable():
+            # one cheap hashing pass can save the whole encode + upload
+            summary = FileController.link_duplicate(filename, params, FileController._hash_stream(stream))
+            if summary:
+                return summary
 
-        original_length = len(original_bytes)
-        encrypted_with_length = struct.pack(">I", original_length) + encrypted_data
+        # AES-GCM encryption + zfec encoding, one segment at a time; shards are spooled to disk
+        key = AESGCM.generate_key(bit_length=256)
+        shard_sinks = [tempfile.TemporaryFile() for _ in range(n)]
+        try:
+            return FileController._store_shards(stream, filename, key, params, shard_sinks, progress)
+        finally:
+            for sink in shard_sinks:
+                sink.close()
 
-        # create file row
-        new_file = File(
-            filename=file.filename,
-            group_id=group_id,
-            account_id=account_id,
-            shard_count=n,
-            required_shards=k,
-            original_length=original_length,
-            key_threshold=t
-        )
+    @staticmethod
+    def _hash_stream(stream):
+        """sha256 of a seekable stream's contents; leaves it rewound."""
+        hasher = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+            hasher.update(chunk)
+        stream.seek(0)
+        return hasher.digest()
 
-        database.session.add(new_file)
-        database.session.flush()
+    @staticmethod
+    def link_duplicate(filename, params, content_hash):
+        """
+        If the group already stores content_hash, add filename as one more reference to those
+        shards and return its upload summary; None if there is nothing to share.
+        """
+        original = File.query.filter_by(group_id=params["group_id"], content_hash=content_hash).first()
+        if not original:
+            database.session.close()
+            return None
 
-        # zfec reed solomon encoding
-        encoder = Encoder(k, n)
-        shards = encoder.encode(encrypted_with_length)
+        # copies point straight at whoever owns the shards (the original, or its container)
+        owner_id = original.container_id or original.file_id
+        try:
+            claimed = database.session.execute(
+                update(File).where(File.file_id == owner_id).values(ref_count=File.ref_count + 1)
+            ).rowcount
+            if not claimed:
+                # the owner was deleted meanwhile: upload normally
+                database.session.rollback()
+                return None
+            new_file = File(
+                file_id=uuid4(),
+                filename=filename,
+                group_id=params["group_id"],
+                account_id=params["account_id"],
+                shard_count=original.shard_count,
+                required_shards=original.required_shards,
+                original_length=original.original_length,
+                key_threshold=original.key_threshold,
+                format_version=original.format_version,
+                segment_size=original.segment_size,
+                segment_count=original.segment_count,
+                container_id=owner_id,
+                container_offset=original.container_offset or 0,
+                content_hash=content_hash
+            )
+            database.session.add(new_file)
+            database.session.commit()
+        except Exception as e:
+            database.session.rollback()
+            raise UploadError(f"Failed to save file metadata: {str(e)}", 500)
+        invalidate(owner_id)
 
-        shard_records = []
+        return {
+            "message": "Upload successful",
+            "file_id": str(new_file.file_id),
+            "deduplicated_from": str(original.file_id),
+            "compression": None,
+            "stored_bytes": 0,
+            "shards": [],
+            "key_shares": []
+        }
 
-        # upload each shards
-        for i, shard in enumerate(shards):
-            dest = fragment_destinations[i]
+    @staticmethod
+    def store_packed(files, params):
+        """
+        Encode files back to back into one container and upload it; the summary lists each file.
+        files: (file, content hash or None) pairs.
+        """
+        key = AESGCM.generate_key(bit_length=256)
+        shard_sinks = [tempfile.TemporaryFile() for _ in range(params["n"])]
+        try:
             try:
-                row = FileController.upload_item(dest, new_file, shard, file, i)
+                encoder = SegmentEncoder(key, params["k"], params["n"], shard_sinks,
+                                         segment_size=PACK_SEGMENT_SIZE, encode=codec_executor.encode_segment,
+                                         compression=params.get("compression"))
+                members = []
+                for file, content_hash in files:
+                    offset = encoder.total_length
+                    encoder.feed_stream(file.stream)
+                    members.append((file.filename, offset, encoder.total_length - offset, content_hash))
+                layout = encoder.finish()
             except Exception as e:
-                database.session.rollback()
-                return jsonify({"error": f"Failed to upload shard {i}: {str(e)}"}), 500
-            database.session.add(row)
-            shard_records.append(row)
+                raise UploadError(f"Failed to encrypt and encode files: {str(e)}", 500)
+
+            return FileController.publish_shards(f"container-{uuid4().hex}", key, params, shard_sinks, layout,
+                                                 members=members, codec=encoder.codec,
+                                                 checksums=encoder.block_checksums)
+        finally:
+            for sink in shard_sinks:
+                sink.close()
+
+    @staticmethod
+    def _store_shards(stream, filename, key, params, shard_sinks, progress):
+        if progress:
+            progress.set_stage("encoding")
+        try:
+            encoder = SegmentEncoder(key, params["k"], params["n"], shard_sinks, encode=codec_executor.encode_segment,
+                                     compression=params.get("compression"))
+            encoder.feed_stream(stream, progress=progress.add_encoded if progress else None)
+            layout = encoder.finish()
+        except Exception as e:
+            raise UploadError(f"Failed to encrypt and encode file: {str(e)}", 500)
+
+        return FileController.publish_shards(filename, key, params, shard_sinks, layout, progress,
+                                             codec=encoder.codec, content_hash=encoder.content_hash,
+                                             checksums=encoder.block_checksums)
+
+    @staticmethod
+    def publish_shards(filename, key, params, shard_sinks, layout, progress=None, members=None, codec=None,
+                       content_hash=None, checksums=None):
+        """
+        Upload encoded shard files and the split key, then record everything in the database.
+        members: (filename, offset, length, content hash) of the files packed into this one, which makes it a container.
+        codec: compression the segments were stored with (layout.payload_lengths has their sizes).
+        checksums: per shard, the block checksums the encoder collected.
+        """
+        n, k, m, t = params["n"], params["k"], params["m"], params["t"]
+        storage_types = params.get("storage_types", {})
+
+        if params.get("dedup") and content_hash and members is None:
+            # streamed uploads only know their hash now; the encoding is spent but the uploads aren't
+            summary = FileController.link_duplicate(filename, params, content_hash)
+            if summary:
+                return summary
+
+        # file row is only written after the uploads: no transaction stays open while they run
+        new_file = File(
+            file_id=uuid4(),
+            filename=filename,
+            group_id=params["group_id"],
+            account_id=params["account_id"],
+            shard_count=n,
+            required_shards=k,
+            original_length=layout.original_length,
+            key_threshold=t,
+            format_version=FORMAT_SEGMENTED,
+            segment_size=layout.segment_size,
+            segment_count=layout.segment_count,
+            is_container=members is not None,
+            ref_count=len(members) if members else 0,
+            compression=codec,
+            segment_lengths=pack_lengths(layout.payload_lengths) if layout.payload_lengths is not None else None,
+            content_hash=content_hash
+        )
+        member_rows = [
+            {
+                "file_id": uuid4(),
+                "filename": member_name,
+                "group_id": params["group_id"],
+                "account_id": params["account_id"],
+                "shard_count": n,
+                "required_shards": k,
+                "original_length": length,
+                "key_threshold": t,
+                "format_version": FORMAT_SEGMENTED,
+                "segment_size": layout.segment_size,
+                "segment_count": layout.segment_count,
+                "container_id": new_file.file_id,
+                "container_offset": offset,
+                "content_hash": member_hash
+            } for member_name, offset, length, member_hash in members or []
+        ]
 
         # Split AES key using shamir
         try:
             if len(key) != 32:
                 raise ValueError(f"AES key should be 32 bytes, got {len(key)} bytes")
 
-            # Split key into two 16-byte parts
-            key_part1 = key[:16]
-            key_part2 = key[16:]
-
-            # Split each part into shares
-            shares1 = Shamir.split(t, m, key_part1)
-            shares2 = Shamir.split(t, m, key_part2)
+            # each 16-byte half gets its own polynomial; share = half1 share + half2 share (32 bytes)
+            shares = split_key(key, t, m)
+        except Exception as e:
+            raise UploadError(f"Failed to split key into shares: {str(e)}", 500)
 
-            # Combine shares from both parts
-            shares = []
-            for i in range(m):
-                idx1, share1 = shares1[i]
-                idx2, share2 = shares2[i]
+        # upload shards and key shares at the same time (bounded by the transfer pool)
+        tasks = []
+        for i, sink in enumerate(shard_sinks):
+            tasks.append((
+                f"Failed to upload shard {i}",
+                FileController._upload_task(params["fragment_destinations"][i], new_file, sink, i,
+                                            progress=progress, storage_type=storage_types.get(
+                                                params["fragment_destinations"][i]["storage_id"]))
+            ))
+        for i, (share_index, share_bytes) in enumerate(shares):
+            share_with_index = struct.pack('B', share_index) + share_bytes
+            tasks.append((
+                "Failed to upload key shares",
+                FileController._upload_task(params["key_destinations"][i], new_file, share_with_index, i,
+                                            is_key=True, progress=progress, storage_type=storage_types.get(
+                                                params["key_destinations"][i]["storage_id"]))
+            ))
 
-                # Verify indices matches
-                if idx1 != idx2:
-                    raise ValueError(f"Share index mismatch: {idx1} != {idx2}")
+        if progress:
+            progress.set_stage("uploading", objects=[("shard", i, layout.shard_length()) for i in range(n)] +
+                                                    [("key", i, 33) for i in range(m)])  # 1-byte index + 32-byte share
+        try:
+            rows = run_all(tasks)
+        except TransferError as e:
+            FileController.cleanup_uploaded(e.results.values(), storage_types)
+            raise UploadError(str(e), 500)
 
-                # Combine both shares into one
-                combined_share = share1 + share2  # 16 + 16 = 32 bytes
-                shares.append((idx1, combined_share))
-        except Exception as e:
-            database.session.rollback()
-            return jsonify({"error": f"Failed to split key into shares: {str(e)}"}), 500
+        shard_records = rows[:n]
+        key_rows = rows[n:]
+        for row in shard_records:
+            row["block_size"] = layout.block_size(0)
+            row["block_checksums"] = bytes(checksums[row["shard_index"]]) if checksums else None
 
-        key_rows = []
+        # one short transaction: the file row, then one multi-row INSERT per table
         try:
-            for i, (share_index, share_bytes) in enumerate(shares):
-                dest = key_destinations[i]
-                share_with_index = struct.pack('B', share_index) + share_bytes
-                row = FileController.upload_item(dest, new_file, share_with_index, file, i, is_key=True)
-                database.session.add(row)
-                key_rows.append(row)
+            database.session.add(new_file)
+            database.session.flush()
+            database.session.execute(insert(FileShard), shard_records)
+            database.session.execute(insert(FileKey), key_rows)
+            if member_rows:
+                database.session.execute(insert(File), member_rows)
+            database.session.commit()
         except Exception as e:
             database.session.rollback()
-            return jsonify({"error": f"Failed to upload key shares: {str(e)}"}), 500
+            FileController.cleanup_uploaded(rows, storage_types)
+            raise UploadError(f"Failed to save file metadata: {str(e)}", 500)
+        invalidate(new_file.file_id)
 
-        # commit all additions to database
-        database.session.commit()
-
-        return jsonify({
+        summary = {
             "message": "Upload successful",
             "file_id": str(new_file.file_id),
+            "compression": codec,
+            "stored_bytes": layout.shard_length() * n,
             "shards": [
                 {
-                    "index": s.shard_index,
-                    "shard_file_id": s.shard_file_id,
-                    "folder_id": s.folder_id,
-                    "storage_id": s.storage_id
+                    "index": s["shard_index"],
+                    "shard_file_id": s["shard_file_id"],
+                    "folder_id": s["folder_id"],
+                    "storage_id": s["storage_id"]
                 } for s in shard_records
             ],
             "key_shares": [
                 {
                     "share_index": idx,
-                    "key_file_id": kr.key_file_id,
-                    "storage_id": kr.storage_id
+                    "key_file_id": kr["key_file_id"],
+                    "storage_id": kr["storage_id"]
                 } for idx, kr in enumerate(key_rows)
             ]
-        })
+        }
+        if members is not None:
+            summary["files"] = [
+                {
+                    "file_id": str(row["file_id"]),
+                    "filename": row["filename"],
+                    "offset": row["container_offset"],
+                    "length": row["original_length"]
+                } for row in member_rows
+            ]
+        return summary
 
     @staticmethod
-    def download_file_from_storage(storage_id, file_id):
-        storage = StorageController.get_storage_info(storage_id)
-        if storage.storage_type == 'google_drive':
-            return FileController.download_google(storage_id, file_id)
-        elif storage.storage_type == 'dropbox':
-            raise ValueError(f"dropbox not implemented yet")
-            # return FileController.download_dropbox(storage_id, file_id)
-        else:
-            raise ValueError(f"Unsupported storage type: {storage.storage_type}")
+    def download_file_from_storage(storage_id, file_id, start=None, end=None, storage_type=None):
+        with placement.observe(storage_id, 0 if start is None else end - start + 1):
+            return get_backend(storage_id, storage_type).get(file_id, start, end)
+
+    @staticmethod
+    def _key_share_task(kr):
+        def fetch():
+            raw = FileController.download_file_from_storage(kr.storage_id, kr.key_file_id,
+                                                             storage_type=kr.storage_type)
+            if not raw or len(raw) < 2:  # At least 1 byte for index + some data
+                raise ValueError("empty or truncated key share")
+
+            # Extract index and share from the stored format
+            share_index = struct.unpack('B', raw[:1])[0]
+            return share_index, raw[1:]
+
+        return fetch
+
+    @staticmethod
+    def _shard_task(s, start=None, end=None, layout=None, segments=None):
+        def fetch():
+            data = FileController.download_file_from_storage(s.storage_id, s.shard_file_id, start, end,
+                                                              storage_type=s.storage_type)
+            if not data:
+                raise ValueError("empty shard")
+            if start is not None and len(data) != end - start + 1:
+                raise ValueError(f"truncated shard: expected {end - start + 1} bytes, got {len(data)}")
+            if segments and s.block_checksums:
+                # a failed check counts as a failed download, so first_k fetches a spare shard instead
+                verify_blocks(layout, s.block_checksums, segments, data)
+            return s.shard_index, data
+
+        return fetch
+
+    @staticmethod
+    def _window_tasks(layout, shard_rows, window):
+        # one ranged request per shard covering every segment in the window
+        start = layout.block_offset(window[0])
+        end = layout.block_offset(window[-1]) + layout.block_size(window[-1]) - 1
+        return [
+            (f"Error downloading shard {s.shard_index}", FileController._shard_task(s, start, end, layout, window))
+            for s in shard_rows
+        ]
+
+    @staticmethod
+    def _decode_window(key_bytes, file_row, layout, window, shard_results, cached=None):
+        """
+        Yield (segment index, plaintext) for every segment in the window.
+        cached: {segment index: blob} from the segment cache (None when it's off); the segments missing
+        there are rebuilt from shard_results and cached in turn.
+        """
+        if cached is not None:
+            yield from FileController._decode_cached_window(key_bytes, file_row, layout, window, shard_results,
+                                                            cached)
+            return
+        shard_results.sort()
+        shard_indices = [shard_index for _, (shard_index, _) in shard_results]
+        base = layout.block_offset(window[0])
+        for i in window:
+            offset = layout.block_offset(i) - base
+            size = layout.block_size(i)
+            blocks = [data[offset:offset + size] for _, (_, data) in shard_results]
+            yield i, codec_executor.decode_segment(key_bytes, layout, i, blocks, shard_indices, file_row.shard_count,
+                                                   file_row.compression)
+
+    @staticmethod
+    def _decode_cached_window(key_bytes, file_row, layout, window, shard_results, cached):
+        # the blob has to come back from the decode, so this runs inline rather than through codec_executor
+        owner_id = file_row.container_id or file_row.file_id
+        aes = AESGCM(key_bytes)
+        if shard_results:
+            shard_results.sort()
+            shard_indices = [shard_index for _, (shard_index, _) in shard_results]
+            base = layout.block_offset(window[0])
+        for i in window:
+            blob = cached.get(i)
+            if blob is None:
+                offset = layout.block_offset(i) - base
+                size = layout.block_size(i)
+                blocks = [data[offset:offset + size] for _, (_, data) in shard_results]
+                blob = decode_blob(blocks, shard_indices, layout.k, file_row.shard_count, layout.blob_length(i))
+                # only cache what authenticates: a bad decode must not outlive the shard that caused it
+                plaintext = open_blob(aes, layout, i, blob, file_row.compression)
+                segment_cache.put(owner_id, i, blob)
+            else:
+                try:
+                    plaintext = open_blob(aes, layout, i, blob, file_row.compression)
+                except Exception:
+                    segment_cache.discard(owner_id, i)
+                    raise
+            yield i, plaintext
+
+    @staticmethod
+    def _cached_segments(owner_id, window):
+        """{segment index: blob} of the window's segments found in the segment cache."""
+        blobs = {i: segment_cache.get(owner_id, i) for i in window}
+        return {i: blob for i, blob in blobs.items() if blob is not None}
+
+    @staticmethod
+    def _parse_range(header, total):
+        """
+        Parse a single "bytes=start-end" Range header.
+        Returns (start, end, partial), or None when the range can't be satisfied.
+        """
+        if not header:
+            return 0, total - 1, False
+
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+        if not match or match.group(1) == match.group(2) == "":
+            return 0, total - 1, False  # multiple or malformed ranges: just send everything
+
+        if match.group(1) == "":
+            # suffix range: the last N bytes
+            suffix = int(match.group(2))
+            if suffix == 0 or total == 0:
+                return None
+            return max(0, total - suffix), total - 1, True
+
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else total - 1
+        if start >= total or end < start:
+            return None
+        return start, min(end, total - 1), True
+
+    @staticmethod
+    def _stream_response(file_row, chunks, start, end, partial):
+        headers = {
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file_row.filename)}",
+            "Content-Length": str(end - start + 1),
+            "Accept-Ranges": "bytes"
+        }
+        if partial:
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_row.original_length}"
+
+        return Response(stream_with_context(chunks), status=206 if partial else 200,
+                        mimetype="application/octet-stream", headers=headers)
 
     @staticmethod
     def download_and_decrypt(file_id):
-        """Download shards + key from Drive, reconstruct, decrypt, return file."""
+        """Download shards + key from Drive, reconstruct, decrypt, stream the file (honours Range)."""
 
-        # look at db record for file, file shards, and key
-        file_row = File.query.filter_by(file_id=file_id).first()
-        if not file_row:
+        # file, shards, key shares and their storages in one (cached) query
+        file_row = get_manifest(file_id)
+        # containers (and originals deleted while copies remain) only hold shards for other files
+        if not file_row or file_row.is_container:
             return jsonify({"error": "File not found"}), 404
 
-        shard_rows = FileShard.query.filter_by(file_id=file_id).order_by(FileShard.shard_index).all()
-        if not shard_rows:
-            return jsonify({"error": "No shards found"}), 404
+        byte_range = FileController._parse_range(request.headers.get("Range"), file_row.original_length)
+        if byte_range is None:
+            return Response(status=416, headers={"Content-Range": f"bytes */{file_row.original_length}"})
+        start, end, partial = byte_range
 
-        key_share_rows = FileKey.query.filter_by(file_id=file_id).all()
-        if not key_share_rows:
-            return jsonify({"error": "No key shares found"}), 404
+        try:
+            chunks = FileController.open_plaintext(file_row, start, end)
+        except DownloadError as e:
+            return jsonify({"error": e.message}), e.status
+        return FileController._stream_response(file_row, chunks, start, end, partial)
 
-        # determine threshold
-        key_threshold = getattr(file_row, "key_threshold", len(key_share_rows))
-        if key_threshold > len(key_share_rows):
-            return jsonify({"error": "Not enough key shares stored to meet the threshold"}), 500
+    @staticmethod
+    def _zip_entry_opener(file_id):
+        def open_file():
+            file_row = get_manifest(file_id)
+            if not file_row:
+                raise DownloadError("File not found", 404)
+            return FileController.open_plaintext(file_row, 0, file_row.original_length - 1)
 
-        # download key shares until threshold is reached
-        key_shares = []
-        for kr in key_share_rows:
-            try:
-                raw = FileController.download_file_from_storage(kr.storage_id, kr.key_file_id)
-                if not raw or len(raw) < 2:  # At least 1 byte for index + some data
-                    continue
+        return open_file
 
-                # Extract index and share from the stored format
-                share_index = struct.unpack('B', raw[:1])[0]
-                share_bytes = raw[1:]
+    @staticmethod
+    def download_zip():
+        """
+        Stream several files as one ZIP archive. JSON body: {"file_ids": [...]} (archived in that
+        order) or {"group_id": ...} (every file of the group, oldest first).
+        """
+        data = request.get_json(silent=True) or {}
+        try:
+            if data.get("file_ids") is not None:
+                file_ids = [UUID(str(file_id)) for file_id in data["file_ids"]]
+                rows = {f.file_id: f for f in File.query.filter(File.file_id.in_(file_ids),
+                                                                 File.is_container.is_(False)).all()}
+                missing = [str(file_id) for file_id in file_ids if file_id not in rows]
+                if missing:
+                    return jsonify({"error": f"File not found: {', '.join(missing)}"}), 404
+                files = [rows[file_id] for file_id in file_ids]
+                archive_name = "files.zip"
+            elif data.get("group_id") is not None:
+                group_id = int(data["group_id"])
+                files = File.query.filter_by(group_id=group_id, is_container=False) \
+                    .order_by(File.created_at, File.file_id).limit(ZIP_MAX_FILES + 1).all()
+                archive_name = f"group-{group_id}.zip"
+            else:
+                return jsonify({"error": "file_ids or group_id is required"}), 400
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid request: {str(e)}"}), 400
 
-                key_shares.append((share_index, share_bytes))
+        if len(files) > ZIP_MAX_FILES:
+            return jsonify({"error": f"At most {ZIP_MAX_FILES} files per archive"}), 400
 
-                if len(key_shares) >= key_threshold:
-                    break
-            except Exception as e:
-                print(f"Failed to download/parse key share {kr.key_file_id}: {e}")
-                continue
+        entries = [
+            ZipEntry(f.filename, f.original_length, f.created_at or datetime.utcnow(),
+                     FileController._zip_entry_opener(f.file_id))
+            for f in files
+        ]
+        database.session.close()  # the archive can take a long time; don't hold a connection for it
 
-        if len(key_shares) < key_threshold:
-            return jsonify({
-                "error": f"Could not download enough key shares. Need {key_threshold}, got {len(key_shares)}"
-            }), 500
+        return Response(stream_with_context(stream_zip(entries)), mimetype="application/zip",
+                        headers={"Content-Disposition": f"attachment; filename=\"{archive_name}\""})
 
-        # reconstruct key from shares
-        try:
-            shares_part1 = []
-            shares_part2 = []
+    @staticmethod
+    def open_plaintext(file_row, start, end):
+        """
+        Fetch the key and the first shards of a file (a manifest) and return an iterator over its
+        plaintext bytes start..end. Raises DownloadError for anything that fails before the first byte.
+        """
+        if not file_row.shards:
+            raise DownloadError("No shards found", 404)
 
-            for share_index, combined_share in key_shares:
-                if len(combined_share) != 32:
-                    raise ValueError(f"Combined share should be 32 bytes, got {len(combined_share)}")
+        if not file_row.keys:
+            raise DownloadError("No key shares found", 404)
 
-                share_part1 = combined_share[:16]
-                share_part2 = combined_share[16:]
+        # skip storages that need re-login (or were removed); they can only fail
+        shard_rows = [s for s in file_row.shards if s.storage_status in READABLE_STATUSES]
+        key_share_rows = [kr for kr in file_row.keys if kr.storage_status in READABLE_STATUSES]
 
-                shares_part1.append((share_index, share_part1))
-                shares_part2.append((share_index, share_part2))
+        # determine threshold
+        key_threshold = file_row.key_threshold
+        if key_threshold > len(key_share_rows):
+            raise DownloadError("Not enough key shares stored to meet the threshold", 500)
 
-            # Reconstruct each part
-            key_part1 = Shamir.combine(shares_part1[:key_threshold])
-            key_part2 = Shamir.combine(shares_part2[:key_threshold])
+        k = file_row.required_shards
+        if k > len(shard_rows):
+            raise DownloadError(f"Not enough shards. Need {k}, got {len(shard_rows)}", 400)
 
-            # Combine back into 32-byte key
-            key_bytes = key_part1 + key_part2
-        except Exception as e:
-            return jsonify({"error": f"Failed to reconstruct AES key from shares: {str(e)}"}), 500
+        # segmented files only fetch the shard ranges covering the requested bytes, a few segments at a time;
+        # a packed file is the bytes at container_offset of its container's stripe
+        base = file_row.container_offset
+        owner_id = file_row.container_id or file_row.file_id
+        caching = segment_cache.SEGMENT_CACHE_ENABLED and file_row.format_version == FORMAT_SEGMENTED
+        cached_key = segment_cache.get_key(owner_id) if caching else None
+        cached = None
+        if file_row.format_version == FORMAT_SEGMENTED:
+            layout = SegmentLayout(file_row.stripe_length, file_row.segment_size, k, file_row.segment_lengths)
+            if file_row.original_length:
+                segments = list(layout.segments_for_range(base + start, base + end))
+            else:
+                segments = [min(base // layout.segment_size, layout.segment_count - 1)]
+            windows = [segments[i:i + SEGMENTS_PER_FETCH] for i in range(0, len(segments), SEGMENTS_PER_FETCH)]
+            if caching:
+                cached = FileController._cached_segments(owner_id, windows[0])
+            missing = [i for i in windows[0] if cached is None or i not in cached]
+            shard_tasks = FileController._window_tasks(layout, shard_rows, windows[0]) if missing else []
+        else:
+            shard_tasks = [
+                (f"Error downloading shard {s.shard_index}", FileController._shard_task(s))
+                for s in shard_rows
+            ]
 
-        # download shards
-        downloaded_shards = []
-        shard_indices = []
-        for s in shard_rows:
+        # fetch key shares and (the first window of) shards in parallel;
+        # only the first key_threshold / k to arrive are used
+        # (a key or segments already in the segment cache aren't fetched at all)
+        key_tasks = [] if cached_key is not None else [
+            (f"Failed to download key share {kr.key_file_id}", FileController._key_share_task(kr))
+            for kr in key_share_rows
+        ]
+        try:
+            key_results, shard_results = first_k([(key_tasks, key_threshold if key_tasks else 0),
+                                                  (shard_tasks, k if shard_tasks else 0)])
+        except TransferError as e:
+            if e.group == 1:
+                raise DownloadError(f"Not enough shards. Need {k}, got {len(e.results)} ({e})", 400)
+            raise DownloadError(
+                f"Could not download enough key shares. Need {key_threshold}, got {len(e.results)}", 500)
+
+        if cached_key is not None:
+            key_bytes = cached_key
+        else:
+            key_shares = [share for _, share in key_results]
+
+            # reconstruct key from shares
             try:
-                data = FileController.download_file_from_storage(s.storage_id, s.shard_file_id)
-                if not data:
-                    continue
-                downloaded_shards.append(data)
-                shard_indices.append(s.shard_index)
+                for share_index, combined_share in key_shares:
+                    if len(combined_share) != 32:
+                        raise ValueError(f"Combined share should be 32 bytes, got {len(combined_share)}")
+
+                key_bytes = combine_key(key_shares[:key_threshold])
             except Exception as e:
-                print(f"Error downloading shard {s.shard_index}: {str(e)}")
-                # Continue with other shards
+                raise DownloadError(f"Failed to reconstruct AES key from shares: {str(e)}", 500)
 
-        k = file_row.required_shards
-        if len(downloaded_shards) < k:
-            return jsonify({"error": f"Not enough shards. Need {k}, got {len(downloaded_shards)}"}), 400
+        aes = AESGCM(key_bytes)
+
+        if file_row.format_version == FORMAT_SEGMENTED:
+            # decode the first segment now so a bad key or corrupt shards still get a proper error response
+            try:
+                first_window = list(FileController._decode_window(key_bytes, file_row, layout, windows[0],
+                                                                  shard_results, cached))
+            except Exception as e:
+                raise DownloadError(f"Failed to reconstruct data: {str(e)}", 500)
+            if caching and cached_key is None:
+                # only now that it has decrypted a segment is the key known to be right
+                segment_cache.put_key(owner_id, key_bytes)
 
-        # reconstruct with zfec
+            def generate():
+                decoded = first_window
+                for window_number, window in enumerate(windows):
+                    if window_number > 0:
+                        window_cached = FileController._cached_segments(owner_id, window) if caching else None
+                        results = None
+                        if not caching or len(window_cached) < len(window):
+                            results, = first_k([(FileController._window_tasks(layout, shard_rows, window), k)])
+                        decoded = FileController._decode_window(key_bytes, file_row, layout, window, results,
+                                                                window_cached)
+
+                    for i, plaintext in decoded:
+                        segment_start = i * layout.segment_size - base
+                        yield plaintext[max(start - segment_start, 0):max(end + 1 - segment_start, 0)]
+
+            return generate()
+
+        shard_results.sort()
+        downloaded_shards = [data for _, (_, data) in shard_results]
+        shard_indices = [shard_index for _, (shard_index, _) in shard_results]
+
+        # legacy files: one length-prefixed blob, reconstruct with zfec
         try:
             n = file_row.shard_count
             decoder = Decoder(k, n)
@@ -357,9 +976,11 @@ class FileController:
             normalized_shards = [s.ljust(shard_size, b"\x00") for s in shards_to_use]
             reconstructed = decoder.decode(normalized_shards, indices_to_use, 0)
             if not reconstructed or len(reconstructed) < 16:
-                return jsonify({"error": "Reconstructed data incomplete"}), 500
+                raise DownloadError("Reconstructed data incomplete", 500)
+        except DownloadError:
+            raise
         except Exception as e:
-            return jsonify({"error": f"Failed to reconstruct data: {str(e)}"}), 500
+            raise DownloadError(f"Failed to reconstruct data: {str(e)}", 500)
 
         # decrypt using reconstructed key_bytes
         try:
@@ -367,14 +988,67 @@ class FileController:
             encrypted_data = reconstructed[4:]
             nonce = encrypted_data[:12]
             ciphertext = encrypted_data[12:]
-            aes = AESGCM(key_bytes)
             decrypted = aes.decrypt(nonce, ciphertext, None)
             if len(decrypted) > original_length:
                 decrypted = decrypted[:original_length]
         except Exception as e:
-            return jsonify({"error": f"Decryption failed: {str(e)}"}), 500
+            raise DownloadError(f"Decryption failed: {str(e)}", 500)
+
+        return iter([decrypted[start:end + 1]])
 
-        return send_file(BytesIO(decrypted),
-                         mimetype="application/octet-stream",
-                         as_attachment=True,
-                         download_name=file_row.filename)
+    @staticmethod
+    def delete_file(file_id):
+        manifest = load_manifest(file_id)
+        if not manifest:
+            return jsonify({"error": "File not found"}), 404
+
+        if manifest.is_container and manifest.ref_count > 0:
+            return jsonify({"error": f"Container still holds {manifest.ref_count} files"}), 409
+
+        # whose shards and key shares these are: packed and deduplicated files only release their owner's
+        owner_id = manifest.container_id or manifest.file_id
+        try:
+            if manifest.container_id:
+                File.query.filter_by(file_id=manifest.file_id).delete()
+                remaining, owner_hidden = database.session.execute(
+                    update(File).where(File.file_id == owner_id)
+                    .values(ref_count=File.ref_count - 1).returning(File.ref_count, File.is_container)
+                ).one()
+                if remaining > 0 or not owner_hidden:
+                    # the owner still has readers, or is a file of its own
+                    database.session.commit()
+                    invalidate(manifest.file_id)
+                    invalidate(owner_id)
+                    return jsonify({"message": "File deleted", "file_id": str(manifest.file_id)})
+                # last reference out of a container: remove the container too
+            else:
+                # lock the row so a concurrent deduplicated upload can't link to it halfway through
+                references = database.session.execute(
+                    select(File.ref_count).where(File.file_id == owner_id).with_for_update()
+                ).scalar_one()
+                if references > 0:
+                    # copies still read these shards: keep them under a hidden owner row
+                    database.session.execute(
+                        update(File).where(File.file_id == owner_id).values(is_container=True)
+                    )
+                    database.session.commit()
+                    invalidate(owner_id)
+                    return jsonify({"message": "File deleted", "file_id": str(manifest.file_id)})
+
+            FileShard.query.filter_by(file_id=owner_id).delete()
+            FileKey.query.filter_by(file_id=owner_id).delete()
+            File.query.filter_by(file_id=owner_id).delete()
+            database.session.commit()
+        except Exception as e:
+            database.session.rollback()
+            return jsonify({"error": f"Failed to delete file: {str(e)}"}), 500
+        invalidate(manifest.file_id)
+        invalidate(owner_id)
+        segment_cache.invalidate(owner_id)
+
+        # metadata is gone, so a failure here only leaves an orphaned object behind
+        FileController.delete_objects(
+            [(s.storage_id, s.shard_file_id, s.storage_type) for s in manifest.shards] +
+            [(kr.storage_id, kr.key_file_id, kr.storage_type) for kr in manifest.keys]
+        )
+        return jsonify({"message": "File deleted", "file_id": str(manifest.file_id)})
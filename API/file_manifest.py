@@ -0,0 +1,190 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import BigInteger, Integer, LargeBinary, cast, func, literal, null, select, union_all
+from sqlalchemy.orm import aliased
+from database import database
+from files import File
+from file_shards import FileShard
+from file_keys import FileKey
+from storage import Storage
+from segment_codec import unpack_lengths
+
+MANIFEST_CACHE_SIZE = int(os.environ.get("MANIFEST_CACHE_SIZE", 1024))
+
+
+@dataclass(frozen=True)
+class ShardEntry:
+    shard_index: int
+    storage_id: int
+    storage_type: str
+    storage_status: str
+    shard_file_id: str
+    shard_size: int
+    block_size: int
+    block_checksums: bytes = None
+
+
+@dataclass(frozen=True)
+class KeyEntry:
+    storage_id: int
+    storage_type: str
+    storage_status: str
+    key_file_id: str
+
+
+@dataclass(frozen=True)
+class FileManifest:
+    """Everything a download needs, detached from the database session (safe to share between threads)."""
+    file_id: uuid.UUID
+    filename: str
+    group_id: int
+    account_id: int
+    shard_count: int
+    required_shards: int
+    key_threshold: int
+    original_length: int
+    format_version: int
+    segment_size: int
+    segment_count: int
+    shards: tuple  # ShardEntry, ordered by shard_index
+    keys: tuple  # KeyEntry
+    # packed files: the shards and keys above belong to the container, and the file is
+    # original_length bytes at container_offset of a stripe_length byte stripe
+    container_id: uuid.UUID = None
+    container_offset: int = 0
+    stripe_length: int = 0
+    is_container: bool = False
+    ref_count: int = 0
+    # compressed files (the container's, for packed files): codec and payload length per segment
+    compression: str = None
+    segment_lengths: tuple = None
+
+
+_cache = OrderedDict()  # file_id -> FileManifest, least recently used first
+_cache_lock = threading.Lock()
+
+
+def _normalize(file_id):
+    return file_id if isinstance(file_id, uuid.UUID) else uuid.UUID(str(file_id))
+
+
+def load_manifest(file_id):
+    """
+    Load a file with its shards, key shares and their storage types in one round trip:
+    files LEFT JOIN (file_shards UNION ALL file_keys) LEFT JOIN storage.
+    For a packed file the shards and key shares are its container's.
+    Returns None if the file doesn't exist.
+    """
+    file_id = _normalize(file_id)
+    # whose shards to load: the container's for packed files, otherwise the file's own
+    owner = select(func.coalesce(File.container_id, File.file_id)).where(File.file_id == file_id).scalar_subquery()
+    container = aliased(File)
+
+    shards = select(
+        FileShard.file_id,
+        literal("shard").label("kind"),
+        FileShard.shard_index.label("shard_index"),
+        FileShard.storage_id,
+        FileShard.shard_file_id.label("object_id"),
+        FileShard.shard_size,
+        FileShard.block_size,
+        FileShard.block_checksums
+    ).where(FileShard.file_id == owner)
+    keys = select(
+        FileKey.file_id,
+        literal("key"),
+        cast(null(), Integer),
+        FileKey.storage_id,
+        FileKey.key_file_id,
+        cast(null(), BigInteger),
+        cast(null(), Integer),
+        cast(null(), LargeBinary)
+    ).where(FileKey.file_id == owner)
+    objects = union_all(shards, keys).subquery()
+
+    rows = database.session.execute(
+        select(File, objects.c.kind, objects.c.shard_index, objects.c.storage_id, objects.c.object_id,
+               objects.c.shard_size, objects.c.block_size, objects.c.block_checksums,
+               Storage.storage_type, Storage.status,
+               container.original_length, container.compression, container.segment_lengths)
+        .outerjoin(container, container.file_id == File.container_id)
+        .outerjoin(objects, objects.c.file_id == func.coalesce(File.container_id, File.file_id))
+        .outerjoin(Storage, Storage.storage_id == objects.c.storage_id)
+        .where(File.file_id == file_id)
+    ).all()
+    if not rows:
+        return None
+
+    file_row = rows[0][0]
+    if file_row.container_id:
+        stripe_length, compression, segment_lengths = rows[0][-3:]
+    else:
+        stripe_length, compression, segment_lengths = (file_row.original_length, file_row.compression,
+                                                       file_row.segment_lengths)
+    shard_entries = []
+    key_entries = []
+    for row in rows:
+        kind, shard_index, storage_id, object_id, shard_size, block_size, block_checksums, storage_type, status = row[1:10]
+        if kind == "shard":
+            shard_entries.append(ShardEntry(shard_index, storage_id, storage_type, status, object_id,
+                                            shard_size, block_size, block_checksums))
+        elif kind == "key":
+            key_entries.append(KeyEntry(storage_id, storage_type, status, object_id))
+    shard_entries.sort(key=lambda s: s.shard_index)
+
+    return FileManifest(
+        file_id=file_row.file_id,
+        filename=file_row.filename,
+        group_id=file_row.group_id,
+        account_id=file_row.account_id,
+        shard_count=file_row.shard_count,
+        required_shards=file_row.required_shards,
+        key_threshold=file_row.key_threshold,
+        original_length=file_row.original_length,
+        format_version=file_row.format_version,
+        segment_size=file_row.segment_size,
+        segment_count=file_row.segment_count,
+        shards=tuple(shard_entries),
+        keys=tuple(key_entries),
+        container_id=file_row.container_id,
+        container_offset=file_row.container_offset or 0,
+        stripe_length=stripe_length,
+        is_container=file_row.is_container,
+        ref_count=file_row.ref_count,
+        compression=compression,
+        segment_lengths=tuple(unpack_lengths(segment_lengths)) if segment_lengths else None
+    )
+
+
+def get_manifest(file_id):
+    """Cached load_manifest; repeat downloads of the same file don't touch the database."""
+    file_id = _normalize(file_id)
+    with _cache_lock:
+        manifest = _cache.get(file_id)
+        if manifest is not None:
+            _cache.move_to_end(file_id)
+            return manifest
+
+    manifest = load_manifest(file_id)
+    if manifest is None:
+        return None
+
+    with _cache_lock:
+        _cache[file_id] = manifest
+        _cache.move_to_end(file_id)
+        while len(_cache) > MANIFEST_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return manifest
+
+
+def invalidate(file_id):
+    with _cache_lock:
+        _cache.pop(_normalize(file_id), None)
+
+
+def clear():
+    with _cache_lock:
+        _cache.clear()
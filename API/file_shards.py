@@ -1,19 +1,25 @@
 from sqlalchemy import func
-from uuid import uuid4
 from database import database
 from sqlalchemy.dialects.postgresql import UUID
 
 
 class FileShard(database.Model):
     __tablename__ = "file_shards"
-
-    # note to self: add foreign keys later
+    __table_args__ = (
+        # one row per shard index; also serves every lookup by file_id
+        database.UniqueConstraint("file_id", "shard_index", name="uq_file_shards_file_id_shard_index"),
+    )
 
     shard_id = database.Column(database.Integer, primary_key=True, autoincrement=True)
-    file_id = database.Column(UUID(as_uuid=True), default=uuid4)
+    file_id = database.Column(UUID(as_uuid=True), database.ForeignKey("files.file_id", ondelete="CASCADE"),
+                              nullable=False)
     shard_index = database.Column(database.Integer, nullable=False)
-    storage_id = database.Column(database.Integer, nullable=False)
+    storage_id = database.Column(database.Integer, database.ForeignKey("storage.storage_id"), nullable=False,
+                                 index=True)
     shard_file_id = database.Column(database.String(255), nullable=False)  # ex: google drive file id
     folder_id = database.Column(database.String(255), nullable=False)
-    shard_size = database.Column(database.Integer, nullable=True)
+    shard_size = database.Column(database.BigInteger, nullable=True)
+    block_size = database.Column(database.Integer, nullable=True)  # bytes per full segment in this shard (format 2)
+    # format 2: checksum of this shard's block of every segment, so bad downloads are caught before decoding
+    block_checksums = database.Column(database.LargeBinary, nullable=True)
     created_at = database.Column(database.DateTime, default=func.now())
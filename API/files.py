@@ -6,6 +6,10 @@ from sqlalchemy.dialects.postgresql import UUID
 
 class File(database.Model):
     __tablename__ = "files"
+    __table_args__ = (
+        # dedup lookups: same content already stored in this group?
+        database.Index("ix_files_group_id_content_hash", "group_id", "content_hash"),
+    )
 
     # note to self: add foreign keys later
 
@@ -14,7 +18,20 @@ class File(database.Model):
     group_id = database.Column(database.Integer, nullable=False)
     account_id = database.Column(database.Integer, nullable=False)
     shard_count = database.Column(database.Integer, nullable=False)
-    original_length = database.Column(database.Integer, nullable=False)
+    original_length = database.Column(database.BigInteger, nullable=False)
     required_shards = database.Column(database.Integer, nullable=False)
     created_at = database.Column(database.DateTime, default=func.now())
-    key_threshold = database.Column(database.Integer, nullable=False, default=1)
\ No newline at end of file
+    key_threshold = database.Column(database.Integer, nullable=False, default=1)
+    format_version = database.Column(database.Integer, nullable=False, default=1)  # see segment_codec
+    segment_size = database.Column(database.Integer, nullable=True)  # plaintext bytes per segment (format 2)
+    segment_count = database.Column(database.Integer, nullable=True)
+    compression = database.Column(database.String(10), nullable=True)  # codec segments were compressed with
+    segment_lengths = database.Column(database.LargeBinary, nullable=True)  # payload length per segment, if compressed
+    # packed and deduplicated files own no shards: their bytes sit at container_offset in container_id's
+    is_container = database.Column(database.Boolean, nullable=False, default=False)
+    container_id = database.Column(UUID(as_uuid=True), database.ForeignKey("files.file_id"), nullable=True,
+                                   index=True)
+    container_offset = database.Column(database.BigInteger, nullable=True)  # plaintext offset inside the container
+    # files stored in this one's shards: packed into this container, or deduplicated against this file
+    ref_count = database.Column(database.Integer, nullable=False, default=0)
+    content_hash = database.Column(database.LargeBinary(32), nullable=True)  # sha256 of the plaintext
@@ -0,0 +1,76 @@
+from database import database
+from group_settings import GroupSettings
+from storage import Storage
+import placement
+from segment_compression import DEFAULT_LEVELS, LEVEL_RANGES, available_codec, valid_level
+
+
+class GroupController:
+    @staticmethod
+    def get_settings(group_id):
+        settings = database.session.get(GroupSettings, group_id)
+        return {
+            "group_id": group_id,
+            "compression": settings.compression if settings else None,
+            "compression_level": settings.compression_level if settings else None,
+            "dedup": settings.dedup if settings else False
+        }
+
+    @staticmethod
+    def update_settings(group_id, changes):
+        """Apply the settings present in changes (compression, compression_level, dedup); others stay as they are."""
+        compression = changes.get("compression")
+        if compression is not None and compression not in DEFAULT_LEVELS:
+            return False, f"compression must be one of {', '.join(DEFAULT_LEVELS)} or null"
+        if "dedup" in changes and not isinstance(changes["dedup"], bool):
+            return False, "dedup must be true or false"
+        try:
+            settings = database.session.get(GroupSettings, group_id)
+            # the level is checked against the codec it ends up with, whichever of the two changed
+            codec = changes["compression"] if "compression" in changes else settings and settings.compression
+            level = changes["compression_level"] if "compression_level" in changes else \
+                settings and settings.compression_level
+            if codec is None and changes.get("compression_level") is not None:
+                return False, "compression_level must be null when compression is off"
+            if codec is not None and level is not None and not valid_level(codec, level):
+                low, high = LEVEL_RANGES[codec]
+                return False, f"compression_level must be null or an integer from {low} to {high} for {codec}"
+            if not settings:
+                settings = GroupSettings(group_id=group_id, dedup=False)
+                database.session.add(settings)
+            for field in ("compression", "compression_level", "dedup"):
+                if field in changes:
+                    setattr(settings, field, changes[field])
+            database.session.commit()
+            return True, GroupController.get_settings(group_id)
+        except Exception as e:
+            database.session.rollback()
+            print(f"Error updating group settings: {e}")
+            return False, f"Failed to update group settings: {str(e)}"
+
+    @staticmethod
+    def upload_settings(group_id):
+        """
+        How new uploads to this group are stored: {"compression": (codec, level) or None, "dedup": bool}.
+        """
+        settings = database.session.get(GroupSettings, group_id) if group_id is not None else None
+        if not settings:
+            return {"compression": None, "dedup": False}
+
+        compression = None
+        codec = available_codec(settings.compression)
+        if codec is not None:
+            level = settings.compression_level
+            if level is None or settings.compression != codec:  # zstd levels don't carry over to the zlib fallback
+                level = DEFAULT_LEVELS[codec]
+            compression = (codec, level)
+        return {"compression": compression, "dedup": settings.dedup}
+
+    @staticmethod
+    def placement_stats(group_id):
+        """Rolling latency / error rate / free space placement=auto works from, per storage of the group."""
+        storages = Storage.query.filter_by(group_id=group_id).order_by(Storage.storage_id).all()
+        stats = placement.storage_stats([s.storage_id for s in storages])
+        for storage, entry in zip(storages, stats):
+            entry["status"] = storage.status
+        return {"group_id": group_id, "storages": stats}
@@ -0,0 +1,12 @@
+from database import database
+
+
+class GroupSettings(database.Model):
+    __tablename__ = "group_settings"
+
+    # groups without a row use the defaults (no compression, no dedup)
+    group_id = database.Column(database.Integer, primary_key=True, autoincrement=False)
+    compression = database.Column(database.String(10), nullable=True)  # zstd, zlib or null for none
+    compression_level = database.Column(database.Integer, nullable=True)  # null: the codec's default
+    # identical uploads share one stored copy (see FileController.link_duplicate)
+    dedup = database.Column(database.Boolean, nullable=False, default=False)
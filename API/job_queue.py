@@ -0,0 +1,79 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from flask import current_app
+
+
+class Job:
+    """A unit of background work; subclasses add their own progress fields to to_dict()."""
+
+    def __init__(self):
+        self.job_id = uuid4().hex
+        self.status = "queued"  # queued -> running -> done / failed
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result = None
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "result": self.result
+        }
+
+
+class JobQueue:
+    """
+    Runs jobs on its own worker pool (separate from the transfer pool, which the jobs
+    themselves use) and remembers finished jobs for `retention` seconds so clients can poll.
+    Jobs live in this process's memory only.
+    """
+
+    def __init__(self, name, max_workers, retention=3600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.retention = retention
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, job, fn, cleanup=None):
+        """Run fn(job) in the background inside the current app's context; cleanup() always runs after."""
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                job.status = "running"
+                job.started_at = time.time()
+                try:
+                    job.result = fn(job)
+                    job.status = "done"
+                except Exception as e:
+                    print(f"Job {job.job_id} failed: {e}")
+                    job.error = getattr(e, "message", str(e))
+                    job.status = "failed"
+                finally:
+                    job.finished_at = time.time()
+                    if cleanup:
+                        cleanup()
+
+        with self.lock:
+            self._prune()
+            self.jobs[job.job_id] = job
+        self.executor.submit(run)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [j.job_id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self.jobs[job_id]
@@ -0,0 +1,8 @@
+-- segmented upload format (see segment_codec.py)
+ALTER TABLE files ALTER COLUMN original_length TYPE BIGINT;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS format_version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS segment_size INTEGER;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS segment_count INTEGER;
+
+ALTER TABLE file_shards ALTER COLUMN shard_size TYPE BIGINT;
+ALTER TABLE file_shards ADD COLUMN IF NOT EXISTS block_size INTEGER;
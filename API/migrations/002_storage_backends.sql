@@ -0,0 +1,3 @@
+-- local-directory and in-memory storage backends (see storage_backends.py)
+ALTER TYPE storage_type_enum ADD VALUE IF NOT EXISTS 'local';
+ALTER TYPE storage_type_enum ADD VALUE IF NOT EXISTS 'memory';
@@ -0,0 +1,2 @@
+-- lets cached credentials expire with the access token (see credential_cache.py)
+ALTER TABLE storage ADD COLUMN IF NOT EXISTS token_expiry TIMESTAMP;
@@ -0,0 +1,2 @@
+-- storages whose refresh token died are flagged instead of failing every request (see token_refresher.py)
+ALTER TABLE storage ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'active';
@@ -0,0 +1,8 @@
+-- keyset pagination on (created_at, account_id) and indexed name/email search (see accountController.py)
+UPDATE users SET created_at = now() WHERE created_at IS NULL;
+ALTER TABLE users ALTER COLUMN created_at SET NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_users_created_at_account_id ON users (created_at, account_id);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS ix_users_name_trgm ON users USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_users_email_trgm ON users USING gin (email gin_trgm_ops);
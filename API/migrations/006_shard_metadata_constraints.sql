@@ -0,0 +1,25 @@
+-- foreign keys and indexes for shard / key share metadata (see file_shards.py, file_keys.py)
+
+-- rows left behind by files deleted before these constraints existed
+DELETE FROM file_shards WHERE file_id IS NULL OR file_id NOT IN (SELECT file_id FROM files);
+DELETE FROM file_keys WHERE file_id IS NULL OR file_id NOT IN (SELECT file_id FROM files);
+-- keep the newest row if a shard index was ever recorded twice
+DELETE FROM file_shards a USING file_shards b
+    WHERE a.file_id = b.file_id AND a.shard_index = b.shard_index AND a.shard_id < b.shard_id;
+
+ALTER TABLE file_shards ALTER COLUMN file_id SET NOT NULL;
+ALTER TABLE file_keys ALTER COLUMN file_id SET NOT NULL;
+
+ALTER TABLE file_shards
+    ADD CONSTRAINT file_shards_file_id_fkey FOREIGN KEY (file_id) REFERENCES files (file_id) ON DELETE CASCADE,
+    ADD CONSTRAINT file_shards_storage_id_fkey FOREIGN KEY (storage_id) REFERENCES storage (storage_id);
+ALTER TABLE file_keys
+    ADD CONSTRAINT file_keys_file_id_fkey FOREIGN KEY (file_id) REFERENCES files (file_id) ON DELETE CASCADE,
+    ADD CONSTRAINT file_keys_storage_id_fkey FOREIGN KEY (storage_id) REFERENCES storage (storage_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_file_shards_file_id_shard_index ON file_shards (file_id, shard_index);
+ALTER TABLE file_shards ADD CONSTRAINT uq_file_shards_file_id_shard_index
+    UNIQUE USING INDEX uq_file_shards_file_id_shard_index;
+CREATE INDEX IF NOT EXISTS ix_file_keys_file_id ON file_keys (file_id);
+CREATE INDEX IF NOT EXISTS ix_file_shards_storage_id ON file_shards (storage_id);
+CREATE INDEX IF NOT EXISTS ix_file_keys_storage_id ON file_keys (storage_id);
@@ -0,0 +1,6 @@
+-- small files packed into shared container files (see FileController.upload_batch)
+ALTER TABLE files ADD COLUMN IF NOT EXISTS is_container BOOLEAN NOT NULL DEFAULT false;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS container_id UUID REFERENCES files (file_id);
+ALTER TABLE files ADD COLUMN IF NOT EXISTS container_offset BIGINT;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS ref_count INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS ix_files_container_id ON files (container_id);
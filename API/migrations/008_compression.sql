@@ -0,0 +1,9 @@
+-- per-group compression before encryption (see segment_compression.py)
+CREATE TABLE IF NOT EXISTS group_settings (
+    group_id INTEGER PRIMARY KEY,
+    compression VARCHAR(10),
+    compression_level INTEGER
+);
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS compression VARCHAR(10);
+ALTER TABLE files ADD COLUMN IF NOT EXISTS segment_lengths BYTEA;
@@ -0,0 +1,4 @@
+-- per-group content-addressed deduplication (see FileController.link_duplicate)
+ALTER TABLE group_settings ADD COLUMN IF NOT EXISTS dedup BOOLEAN NOT NULL DEFAULT false;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash BYTEA;
+CREATE INDEX IF NOT EXISTS ix_files_group_id_content_hash ON files (group_id, content_hash);
@@ -0,0 +1,2 @@
+-- per-block checksums of every shard (see segment_codec.verify_blocks); older shards have none
+ALTER TABLE file_shards ADD COLUMN IF NOT EXISTS block_checksums BYTEA;
@@ -0,0 +1,41 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))  # cost factor for new hashes
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", os.cpu_count() or 1))
+# hash/check calls allowed to wait for a worker before new ones are turned away
+BCRYPT_MAX_QUEUE = int(os.environ.get("BCRYPT_MAX_QUEUE", BCRYPT_WORKERS * 4))
+RETRY_AFTER = int(os.environ.get("BCRYPT_RETRY_AFTER", 1))  # seconds, sent with the 503
+
+# bcrypt releases the GIL while hashing, so a thread pool uses every core
+_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(BCRYPT_WORKERS + BCRYPT_MAX_QUEUE)
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashes already running or queued; the caller should retry later."""
+
+    def __init__(self):
+        super().__init__("Password hashing is overloaded, try again later")
+        self.retry_after = RETRY_AFTER
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        return _executor.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    """bcrypt hash of password (str) at BCRYPT_ROUNDS, as a str ready for the users table."""
+    hashed = _run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+    return hashed.decode('utf-8')
+
+
+def check_password(password, hashed):
+    return _run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
@@ -0,0 +1,246 @@
+"""
+Server-side choice of shard and key share destinations (uploads sent with placement=auto).
+
+Every call to a storage backend is timed and counted here, so each storage carries a rolling
+(exponentially weighted) latency and error rate. Free space comes from the backend's quota(),
+cached for QUOTA_TTL seconds minus whatever we placed there since. Placement then hands out
+destinations one at a time to the cheapest storage, where cost grows with latency, error rate,
+how full the storage is and how much of this upload it already holds, and no storage may hold
+k shards or t key shares (it could rebuild the file or the key on its own).
+
+The statistics live in this process's memory: every worker learns them from its own traffic.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from storage import Storage
+from storage_backends import get_backend
+from transfer_pool import run_all, TransferError
+
+EWMA_WEIGHT = float(os.environ.get("PLACEMENT_EWMA_WEIGHT", 0.2))  # weight of the newest sample
+ERROR_HALF_LIFE = float(os.environ.get("PLACEMENT_ERROR_HALF_LIFE", 600))  # seconds for old failures to count half
+QUOTA_TTL = int(os.environ.get("PLACEMENT_QUOTA_TTL", 300))  # seconds a backend's quota answer is trusted
+# below this fraction of free space a storage gets more and more expensive; none at all below MIN_FREE_BYTES
+LOW_SPACE_FRACTION = float(os.environ.get("PLACEMENT_LOW_SPACE_FRACTION", 0.1))
+MIN_FREE_BYTES = int(os.environ.get("PLACEMENT_MIN_FREE_BYTES", 64 * 1024 * 1024))
+SIZE_UNIT = 1024 * 1024  # latencies are recorded per call plus per MiB moved, so shard sizes don't skew them
+DEFAULT_LATENCY = 1.0  # seconds, for storages nobody has talked to yet (unless others are known)
+
+
+class PlacementError(Exception):
+    """The group's storages can't take this upload under the placement rules."""
+
+
+class _Stats:
+    def __init__(self):
+        self.latency = None  # seconds per call (per MiB beyond the first)
+        self.error_rate = 0.0
+        self.errors_at = time.monotonic()  # when error_rate was last brought up to date
+        self.calls = 0
+        self.quota = None  # (free bytes, total bytes) from the backend, None if it has no limit
+        self.quota_at = None
+        self.reserved = 0  # bytes placed here since the quota was read
+
+    def decayed_error_rate(self, now):
+        return self.error_rate * 0.5 ** ((now - self.errors_at) / ERROR_HALF_LIFE)
+
+
+_stats = {}  # storage_id -> _Stats
+_lock = threading.Lock()
+
+
+def _get(storage_id):
+    stats = _stats.get(storage_id)
+    if stats is None:
+        with _lock:
+            stats = _stats.setdefault(storage_id, _Stats())
+    return stats
+
+
+def record(storage_id, seconds, ok, nbytes=0):
+    """Feed one backend call into the storage's rolling latency and error rate."""
+    stats = _get(storage_id)
+    now = time.monotonic()
+    with _lock:
+        stats.calls += 1
+        stats.error_rate = stats.decayed_error_rate(now) * (1 - EWMA_WEIGHT) + (0 if ok else EWMA_WEIGHT)
+        stats.errors_at = now
+        if ok:
+            # failures return early, so their timing says nothing about the storage's speed
+            sample = seconds / (1 + nbytes / SIZE_UNIT)
+            stats.latency = sample if stats.latency is None else \
+                stats.latency * (1 - EWMA_WEIGHT) + sample * EWMA_WEIGHT
+
+
+@contextmanager
+def observe(storage_id, nbytes=0):
+    """Time the backend call in the with block (failures count as errors and are re-raised)."""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        record(storage_id, time.monotonic() - started, False)
+        raise
+    record(storage_id, time.monotonic() - started, True, nbytes)
+
+
+def _quota_task(storage):
+    def fetch():
+        return get_backend(storage.storage_id, storage.storage_type).quota()
+
+    return fetch
+
+
+def _refresh_quotas(storages):
+    now = time.monotonic()
+    stale = [s for s in storages if _get(s.storage_id).quota_at is None or
+             now - _get(s.storage_id).quota_at > QUOTA_TTL]
+    if not stale:
+        return
+    try:
+        quotas = run_all([(f"Failed to read quota of storage {s.storage_id}", _quota_task(s)) for s in stale],
+                         limit=len(stale))
+    except TransferError as e:
+        # place with what we have; the failing storage keeps its last answer and is asked again next time
+        print(e)
+        stale = [s for i, s in enumerate(stale) if i in e.results]
+        quotas = [e.results[i] for i in sorted(e.results)]
+    with _lock:
+        for storage, quota in zip(stale, quotas):
+            stats = _get(storage.storage_id)
+            stats.quota = None if quota is None else (quota["total"] - quota["used"], quota["total"])
+            stats.quota_at = now
+            stats.reserved = 0
+
+
+def _free(stats):
+    """(free bytes, free fraction) with our own recent placements taken off, or None if unlimited/unknown."""
+    if stats.quota is None:
+        return None
+    free, total = stats.quota
+    free -= stats.reserved
+    return free, free / total if total else 0.0
+
+
+def _base_cost(stats, now, default_latency):
+    latency = stats.latency if stats.latency is not None else default_latency
+    # a storage that fails half its calls costs ~4x: each failure means a retry on another one
+    cost = latency / max(0.05, 1 - stats.decayed_error_rate(now)) ** 2
+    free = _free(stats)
+    if free is not None and free[1] < LOW_SPACE_FRACTION:
+        cost *= LOW_SPACE_FRACTION / max(free[1], 0.001)
+    return cost
+
+
+def _assign(candidates, count, cap, costs, fits, held=None):
+    """
+    Greedily give count slots to candidates, at most cap each; cost rises with what a storage already holds.
+    held: {storage_id: slots} already taken before this call.
+    """
+    held = {s.storage_id: (held or {}).get(s.storage_id, 0) for s in candidates}
+    chosen = []
+    for _ in range(count):
+        options = [s for s in candidates if held[s.storage_id] < cap and fits(s, held[s.storage_id] + 1)]
+        if not options:
+            return None
+        best = min(options, key=lambda s: (costs[s.storage_id] * (1 + held[s.storage_id]), s.storage_id))
+        held[best.storage_id] += 1
+        chosen.append(best)
+    return chosen
+
+
+def group_candidates(group_id):
+    """The group's storages that take uploads (quotas refreshed)."""
+    candidates = Storage.query.filter_by(group_id=group_id, status="active").order_by(Storage.storage_id).all()
+    if not candidates:
+        raise PlacementError(f"Group {group_id} has no active storage")
+    _refresh_quotas(candidates)
+    return candidates
+
+
+def _costs(candidates):
+    now = time.monotonic()
+    known = [_get(s.storage_id).latency for s in candidates if _get(s.storage_id).latency is not None]
+    # new storages look like an average one, so they get traffic and start collecting samples
+    default_latency = sum(known) / len(known) if known else DEFAULT_LATENCY
+    return {s.storage_id: _base_cost(_get(s.storage_id), now, default_latency) for s in candidates}
+
+
+def _fits(shard_size):
+    def fits(storage, shards):
+        free = _free(_get(storage.storage_id))
+        return free is None or free[0] - shards * shard_size >= MIN_FREE_BYTES
+
+    return fits
+
+
+def _reserve(storages, size):
+    with _lock:
+        for storage in storages:
+            _get(storage.storage_id).reserved += size
+
+
+def choose(group_id, n, k, m, t, file_size=None):
+    """
+    Destinations for n shards and m key shares of a file_size byte upload (None: unknown) to group_id.
+    Returns (fragment_destinations, key_destinations, storage_types); raises PlacementError.
+    """
+    if group_id is None:
+        raise PlacementError("placement=auto needs a group_id")
+    if k < 2 or t < 2:
+        raise PlacementError("placement=auto needs k and t of at least 2 (a single storage could rebuild the file)")
+
+    candidates = group_candidates(group_id)
+    # every shard is about 1/k of the file
+    shard_size = -(-file_size // k) if file_size else 0
+    costs = _costs(candidates)
+    shard_storages = _assign(candidates, n, k - 1, costs, _fits(shard_size))
+    if shard_storages is None:
+        raise PlacementError(f"Group {group_id} can't hold {n} shards with at most {k - 1} per storage "
+                             f"and {MIN_FREE_BYTES} bytes kept free")
+    key_storages = _assign(candidates, m, t - 1, costs, lambda storage, shares: True)
+    if key_storages is None:
+        raise PlacementError(f"Group {group_id} can't hold {m} key shares with at most {t - 1} per storage")
+
+    _reserve(shard_storages, shard_size)
+    return (
+        [{"storage_id": s.storage_id} for s in shard_storages],
+        [{"storage_id": s.storage_id} for s in key_storages],
+        {s.storage_id: s.storage_type for s in candidates}
+    )
+
+
+def replacements(group_id, threshold, held, count, size, candidates=None):
+    """
+    Storages for count more shards (threshold k) or key shares (threshold t) of a file whose others sit
+    on held ({storage_id: count}), under the same rules as choose(). candidates defaults to
+    group_candidates(group_id). Returns [(storage_id, storage_type)]; raises PlacementError.
+    """
+    if candidates is None:
+        candidates = group_candidates(group_id)
+    chosen = _assign(candidates, count, threshold - 1, _costs(candidates), _fits(size), held)
+    if chosen is None:
+        raise PlacementError(f"Group {group_id} has no room for {count} more objects with at most "
+                             f"{threshold - 1} per storage")
+    _reserve(chosen, size)
+    return [(s.storage_id, s.storage_type) for s in chosen]
+
+
+def storage_stats(storage_ids):
+    """What placement currently knows about each storage, for monitoring."""
+    now = time.monotonic()
+    result = []
+    for storage_id in storage_ids:
+        stats = _get(storage_id)
+        free = _free(stats)
+        result.append({
+            "storage_id": storage_id,
+            "calls": stats.calls,
+            "latency": stats.latency,
+            "error_rate": round(stats.decayed_error_rate(now), 4),
+            "free_bytes": free[0] if free else None,
+            "total_bytes": stats.quota[1] if stats.quota else None,
+            "quota_age": None if stats.quota_at is None else round(now - stats.quota_at, 1)
+        })
+    return result
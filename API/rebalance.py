@@ -0,0 +1,359 @@
+"""
+Evacuation of a storage: move every shard and key share it holds to other storages of its group.
+
+The storage is marked draining first, so uploads and placement stop using it while downloads
+still read from it (one that needs re-login keeps that status). Objects are then moved in batches of EVACUATION_BATCH_SIZE:
+- each shard is streamed from the old storage into a spool file in COPY_CHUNK_SIZE ranged
+  reads and uploaded to its new storage; if it can't be read, it's rebuilt from k other shards
+  instead (scrubber.rebuild_blocks);
+- each key share is copied, or re-derived from t other shares of the same key;
+- destinations follow the placement rules (fewer than k shards / t shares per storage), over
+  the group's active storages or the ones the caller listed;
+- a batch's new locations are written with one bulk UPDATE per table, then the old objects
+  are deleted.
+Up to EVACUATION_CONCURRENCY objects are in flight at once, on threads of their own: a rebuild
+waits on the shared transfer pool, and the pool is left to user traffic. When nothing is left
+on the storage it's marked retired; objects that failed stay put and the job can simply be run
+again.
+"""
+import os
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, select, update
+from database import database
+from files import File
+from file_shards import FileShard
+from file_keys import FileKey
+from storage import Storage, READABLE_STATUSES
+from storage_backends import get_backend
+from shamir_batch import derive_shares
+from job_queue import Job, JobQueue
+from transfer_pool import run_all
+import file_manifest
+import placement
+import scrubber
+
+EVACUATION_WORKERS = int(os.environ.get("EVACUATION_WORKERS", 1))  # evacuations running at once
+EVACUATION_BATCH_SIZE = int(os.environ.get("EVACUATION_BATCH_SIZE", 500))  # objects per metadata batch
+EVACUATION_CONCURRENCY = int(os.environ.get("EVACUATION_CONCURRENCY", 16))  # objects moving at once
+COPY_CHUNK_SIZE = int(os.environ.get("EVACUATION_COPY_CHUNK_SIZE", 8 * 1024 * 1024))
+MAX_REPORTED_FAILURES = 50
+
+_executor = ThreadPoolExecutor(max_workers=EVACUATION_WORKERS * EVACUATION_CONCURRENCY,
+                               thread_name_prefix="evacuation")
+
+
+class EvacuationJob(Job):
+    """Progress of one evacuation: counts of shards / key shares moved, rebuilt and failed."""
+
+    def __init__(self, storage_id, destinations=None):
+        super().__init__()
+        self.storage_id = storage_id
+        self.destinations = destinations
+        self.total_shards = 0
+        self.total_keys = 0
+        self.moved_shards = 0
+        self.moved_keys = 0
+        self.rebuilt = 0  # of the moved ones, how many couldn't be read and were re-derived
+        self.failed = 0
+        self.bytes_copied = 0
+        self.failures = []
+
+    def object_moved(self, kind, size, rebuilt):
+        with self.lock:
+            if kind == "shard":
+                self.moved_shards += 1
+            else:
+                self.moved_keys += 1
+            self.bytes_copied += size
+            self.rebuilt += 1 if rebuilt else 0
+
+    def object_failed(self, message):
+        print(f"Evacuation of storage {self.storage_id}: {message}")
+        with self.lock:
+            self.failed += 1
+            if len(self.failures) < MAX_REPORTED_FAILURES:
+                self.failures.append(message)
+
+    def to_dict(self):
+        with self.lock:
+            data = super().to_dict()
+            data.update({
+                "storage_id": self.storage_id,
+                "destinations": self.destinations,
+                "total_shards": self.total_shards,
+                "total_keys": self.total_keys,
+                "moved_shards": self.moved_shards,
+                "moved_keys": self.moved_keys,
+                "rebuilt": self.rebuilt,
+                "failed": self.failed,
+                "bytes_copied": self.bytes_copied,
+                "failures": list(self.failures)
+            })
+            return data
+
+
+class Evacuations:
+    queue = JobQueue("evacuation", EVACUATION_WORKERS)
+    _running = {}  # storage_id -> job, so one storage isn't evacuated twice at the same time
+    _running_lock = threading.Lock()
+
+    @staticmethod
+    def start(storage_id, destinations=None):
+        """
+        Mark the storage draining (unless it needs re-login) and queue its evacuation.
+        Returns the job (or the one already running).
+        """
+        with Evacuations._running_lock:
+            job = Evacuations._running.get(storage_id)
+            if job and job.status in ("queued", "running"):
+                return job
+            job = EvacuationJob(storage_id, destinations)
+            Evacuations._running[storage_id] = job
+
+        # a storage that needs re-login keeps saying so: its objects get rebuilt from the others,
+        # and the token refresh isn't retried behind the job's back
+        database.session.execute(update(Storage).where(Storage.storage_id == storage_id, Storage.status == "active")
+                                 .values(status="draining"))
+        database.session.commit()
+        file_manifest.clear()
+        Evacuations.queue.submit(job, evacuate)
+        return job
+
+    @staticmethod
+    def get(job_id):
+        return Evacuations.queue.get(job_id)
+
+
+def _copy_shard(source, storage_type, sink):
+    """Stream a whole shard object into sink with ranged reads; raises if it's missing or the wrong size."""
+    backend = get_backend(source.storage_id, storage_type)
+    info = backend.stat(source.shard_file_id)
+    if info is None:
+        raise ValueError("object is gone")
+    size = info["size"]
+    if source.shard_size is not None and size != source.shard_size:
+        raise ValueError(f"object is {size} bytes, expected {source.shard_size}")
+    for start in range(0, size, COPY_CHUNK_SIZE):
+        end = min(start + COPY_CHUNK_SIZE, size) - 1
+        with placement.observe(source.storage_id, end - start + 1):
+            sink.write(backend.get(source.shard_file_id, start, end))
+
+
+def _shard_task(job, shard, file_row, siblings, storage_types, destination):
+    def move():
+        storage_id, storage_type = destination
+        rebuilt = False
+        with tempfile.TemporaryFile() as sink:
+            try:
+                _copy_shard(shard, storage_types[shard.storage_id], sink)
+            except Exception as e:
+                # unreadable: recompute it from k other shards of the file
+                print(f"Shard {shard.shard_index} of file {shard.file_id} unreadable ({e}), rebuilding")
+                sink.seek(0)
+                sink.truncate()
+                good = [s for s in siblings if s.shard_id != shard.shard_id and storage_types.get(s.storage_id)]
+                scrubber.rebuild_blocks(file_row, good, [shard.shard_index], storage_types, {shard.shard_index: sink})
+                rebuilt = True
+            size = sink.seek(0, 2)
+            name = f"{file_row.filename}.shard{shard.shard_index}"
+            with placement.observe(storage_id, size):
+                object_id = get_backend(storage_id, storage_type).put(sink, name)
+        job.object_moved("shard", size, rebuilt)
+        return {"shard_id": shard.shard_id, "storage_id": storage_id, "shard_file_id": object_id,
+                "folder_id": "", "shard_size": size}
+
+    return move
+
+
+def _read_key(key_row, storage_type):
+    raw = get_backend(key_row.storage_id, storage_type).get(key_row.key_file_id)
+    if not raw or len(raw) != 33:  # 1-byte index + 32-byte share
+        raise ValueError("empty or truncated key share")
+    return raw
+
+
+def _key_task(job, file_row, moving, siblings, storage_types, destinations):
+    """Move all of one file's key shares on the storage together: re-deriving needs to see the others."""
+    def move():
+        contents = {}
+        for key_row in moving:
+            try:
+                contents[key_row.key_id] = _read_key(key_row, storage_types[key_row.storage_id])
+            except Exception as e:
+                print(f"Key share {key_row.key_file_id} of file {key_row.file_id} unreadable ({e})")
+
+        lost = [key_row for key_row in moving if key_row.key_id not in contents]
+        if lost:
+            # the lost shares' indices are the ones no other share of this key has
+            lost_ids = {kr.key_id for kr in lost}
+            others = [_read_key(kr, storage_types[kr.storage_id]) for kr in siblings
+                      if kr.key_id not in lost_ids and storage_types.get(kr.storage_id)]
+            shares = [(raw[0], raw[1:]) for raw in others]
+            missing = sorted(set(range(1, len(siblings) + 1)) - {index for index, _ in shares})
+            if len(shares) < file_row.key_threshold or len(missing) != len(lost):
+                raise ValueError(f"can't re-derive {len(lost)} key shares from {len(shares)} readable ones")
+            for key_row, (index, share) in zip(lost, derive_shares(shares[:file_row.key_threshold], missing)):
+                contents[key_row.key_id] = struct.pack('B', index) + share
+
+        rows = []
+        for key_row, (storage_id, storage_type) in zip(moving, destinations):
+            data = contents[key_row.key_id]
+            with placement.observe(storage_id, len(data)):
+                object_id = get_backend(storage_id, storage_type).put(data, f"{file_row.filename}.key")
+            job.object_moved("key", len(data), key_row in lost)
+            rows.append({"key_id": key_row.key_id, "storage_id": storage_id, "key_file_id": object_id})
+        return rows
+
+    return move
+
+
+def _guarded(job, label, fn):
+    # one object failing mustn't stop the batch
+    def run():
+        try:
+            return fn()
+        except Exception as e:
+            job.object_failed(f"{label}: {e}")
+            return None
+
+    return run
+
+
+def _context(file_ids):
+    """Files, every shard and key share of them, and the storage_type of every readable storage involved."""
+    files = {f.file_id: f for f in File.query.filter(File.file_id.in_(file_ids)).all()}
+    shards = FileShard.query.filter(FileShard.file_id.in_(file_ids)).all()
+    keys = FileKey.query.filter(FileKey.file_id.in_(file_ids)).all()
+    storage_ids = {s.storage_id for s in shards} | {k.storage_id for k in keys}
+    storage_types = {s.storage_id: s.storage_type if s.status in READABLE_STATUSES else None
+                     for s in Storage.query.filter(Storage.storage_id.in_(storage_ids)).all()}
+    return files, shards, keys, storage_types
+
+
+def _held(rows, exclude):
+    held = {}
+    for row in rows:
+        if row not in exclude:
+            held[row.storage_id] = held.get(row.storage_id, 0) + 1
+    return held
+
+
+def _delete_old(objects):
+    for storage_id, object_id, storage_type in objects:
+        try:
+            get_backend(storage_id, storage_type).delete(object_id)
+        except Exception as e:
+            print(f"Failed to delete evacuated object {object_id}: {e}")
+
+
+def _evacuate_shards(job, source, candidates):
+    after = 0
+    while True:
+        batch = FileShard.query.filter(FileShard.storage_id == source.storage_id, FileShard.shard_id > after) \
+            .order_by(FileShard.shard_id).limit(EVACUATION_BATCH_SIZE).all()
+        if not batch:
+            return
+        after = batch[-1].shard_id
+        files, shards, _, storage_types = _context({s.file_id for s in batch})
+        database.session.close()
+
+        by_file = {}
+        for s in shards:
+            by_file.setdefault(s.file_id, []).append(s)
+        tasks = []
+        for file_id, siblings in by_file.items():
+            moving = [s for s in siblings if s.storage_id == source.storage_id and s.shard_id <= after]
+            if not moving:
+                continue
+            file_row = files[file_id]
+            try:
+                chosen = placement.replacements(source.group_id, file_row.required_shards,
+                                                _held(siblings, moving), len(moving),
+                                                moving[0].shard_size or 0, candidates)
+            except placement.PlacementError as e:
+                for s in moving:
+                    job.object_failed(f"shard {s.shard_index} of file {file_id}: {e}")
+                continue
+            for s, destination in zip(moving, chosen):
+                label = f"shard {s.shard_index} of file {file_id}"
+                tasks.append((label, _guarded(job, label, _shard_task(job, s, file_row, siblings, storage_types,
+                                                                      destination))))
+
+        rows = [row for row in run_all(tasks, limit=EVACUATION_CONCURRENCY, executor=_executor) if row]
+        if rows:
+            old = {s.shard_id: s for s in batch}
+            database.session.execute(update(FileShard), rows)
+            database.session.commit()
+            file_manifest.clear()
+            _delete_old([(source.storage_id, old[row["shard_id"]].shard_file_id, source.storage_type) for row in rows])
+
+
+def _evacuate_keys(job, source, candidates):
+    after = 0
+    while True:
+        batch = FileKey.query.filter(FileKey.storage_id == source.storage_id, FileKey.key_id > after) \
+            .order_by(FileKey.key_id).limit(EVACUATION_BATCH_SIZE).all()
+        if not batch:
+            return
+        after = batch[-1].key_id
+        files, _, keys, storage_types = _context({k.file_id for k in batch})
+        database.session.close()
+
+        by_file = {}
+        for key_row in keys:
+            by_file.setdefault(key_row.file_id, []).append(key_row)
+        tasks = []
+        for file_id, siblings in by_file.items():
+            moving = [kr for kr in siblings if kr.storage_id == source.storage_id and kr.key_id <= after]
+            if not moving:
+                continue
+            file_row = files[file_id]
+            try:
+                chosen = placement.replacements(source.group_id, file_row.key_threshold,
+                                                _held(siblings, moving), len(moving), 0, candidates)
+            except placement.PlacementError as e:
+                job.object_failed(f"key shares of file {file_id}: {e}")
+                continue
+            label = f"key shares of file {file_id}"
+            tasks.append((label, _guarded(job, label, _key_task(job, file_row, moving, siblings, storage_types,
+                                                                  chosen))))
+
+        rows = [row for result in run_all(tasks, limit=EVACUATION_CONCURRENCY, executor=_executor) if result for row in result]
+        if rows:
+            old = {kr.key_id: kr for kr in batch}
+            database.session.execute(update(FileKey), rows)
+            database.session.commit()
+            file_manifest.clear()
+            _delete_old([(source.storage_id, old[row["key_id"]].key_file_id, source.storage_type) for row in rows])
+
+
+def evacuate(job):
+    """Job body: move everything off job.storage_id. Runs in the evacuation queue's app context."""
+    source = database.session.get(Storage, job.storage_id)
+    job.total_shards = database.session.scalar(
+        select(func.count()).select_from(FileShard).where(FileShard.storage_id == source.storage_id))
+    job.total_keys = database.session.scalar(
+        select(func.count()).select_from(FileKey).where(FileKey.storage_id == source.storage_id))
+
+    candidates = [s for s in placement.group_candidates(source.group_id) if s.storage_id != source.storage_id]
+    if job.destinations:
+        candidates = [s for s in candidates if s.storage_id in job.destinations]
+    database.session.expunge_all()  # keep source and candidates usable across the batches' session.close()
+    if not candidates:
+        raise placement.PlacementError(f"No storage to move storage {source.storage_id}'s objects to")
+
+    _evacuate_shards(job, source, candidates)
+    _evacuate_keys(job, source, candidates)
+
+    left = database.session.scalar(select(func.count()).select_from(FileShard)
+                                   .where(FileShard.storage_id == source.storage_id)) + \
+        database.session.scalar(select(func.count()).select_from(FileKey)
+                                .where(FileKey.storage_id == source.storage_id))
+    if not left:
+        database.session.execute(update(Storage).where(Storage.storage_id == source.storage_id)
+                                 .values(status="retired"))
+        database.session.commit()
+    return {"retired": not left, "objects_left": left}
@@ -0,0 +1,51 @@
+from flask import request, jsonify
+from database import database
+from storage import Storage
+from rebalance import Evacuations
+
+
+class RebalanceController:
+
+    @staticmethod
+    def evacuate_storage(storage_id):
+        """
+        Start moving everything off a storage. Optional JSON body {"destinations": [storage_id, ...]}
+        limits where it goes; by default any active storage of the same group.
+        """
+        data = request.get_json(silent=True) or {}
+        source = database.session.get(Storage, storage_id)
+        if not source:
+            return jsonify({"error": "Storage not found"}), 404
+
+        destinations = data.get("destinations")
+        if destinations is not None:
+            try:
+                destinations = [int(d) for d in destinations]
+            except (TypeError, ValueError):
+                return jsonify({"error": "destinations must be a list of storage ids"}), 400
+            usable = {s.storage_id for s in Storage.query.filter(
+                Storage.storage_id.in_(destinations), Storage.group_id == source.group_id,
+                Storage.status == "active").all()}
+            bad = [str(d) for d in destinations if d not in usable or d == storage_id]
+            if bad:
+                return jsonify({"error": f"Not an active storage of group {source.group_id}: {', '.join(bad)}"}), 400
+
+        try:
+            job = Evacuations.start(storage_id, destinations)
+        except Exception as e:
+            database.session.rollback()
+            print(f"Error starting evacuation of storage {storage_id}: {e}")
+            return jsonify({"error": f"Failed to start evacuation: {str(e)}"}), 500
+
+        return jsonify({
+            "message": "Evacuation queued",
+            "job_id": job.job_id,
+            "status_url": f"/API/storage/evacuate/status/{job.job_id}"
+        }), 202
+
+    @staticmethod
+    def evacuation_status(job_id):
+        job = Evacuations.get(job_id)
+        if not job:
+            return jsonify({"error": "Evacuation job not found"}), 404
+        return jsonify(job.to_dict())
@@ -0,0 +1,324 @@
+"""
+Background scrub and repair of shards.
+
+Walks the files that own shards in file_id order, SCRUB_BATCH_SIZE at a time, and checks
+every shard with a metadata stat() (no download). A shard counts as lost when its object is
+gone or has the wrong size, or when its storage needs re-login. A file that has fewer than
+k + SCRUB_MIN_SPARE_SHARDS good shards left gets only its lost shard indices rebuilt: k good
+shards are read segment by segment, zfec recomputes the missing blocks (no key needed, the
+blocks are ciphertext) and the new shard objects replace the lost ones. Storages that are
+still active get their shard back; the others' move to another storage of the group.
+
+Every backend call the scrubber makes waits for its storage's token bucket, so a sweep never
+takes more than SCRUB_RATE calls per second from one storage away from user traffic.
+
+Off unless SCRUBBER_ENABLED=1, and that should be set for exactly one process: every process
+that has it sweeps on its own, so several would rebuild the same shards twice (and multiply
+SCRUB_RATE). Gunicorn workers and the Flask reloader all import app.py.
+"""
+import os
+import tempfile
+import threading
+import time
+import zfec
+from sqlalchemy import update
+from database import database
+from files import File
+from file_shards import FileShard
+from storage import Storage, READABLE_STATUSES
+from storage_backends import get_backend
+from segment_codec import FORMAT_SEGMENTED, SegmentLayout, unpack_lengths, verify_blocks
+from transfer_pool import run_all
+import file_manifest
+import placement
+
+SCRUBBER_ENABLED = os.environ.get("SCRUBBER_ENABLED", "0") == "1"
+SCRUB_BATCH_SIZE = int(os.environ.get("SCRUB_BATCH_SIZE", 100))  # files per batch
+SCRUB_BATCH_PAUSE = float(os.environ.get("SCRUB_BATCH_PAUSE", 5))  # seconds between batches
+SCRUB_PASS_INTERVAL = int(os.environ.get("SCRUB_PASS_INTERVAL", 6 * 3600))  # seconds between full sweeps
+SCRUB_MIN_SPARE_SHARDS = int(os.environ.get("SCRUB_MIN_SPARE_SHARDS", 1))  # repair below k + this many good shards
+SCRUB_RATE = float(os.environ.get("SCRUB_RATE", 5))  # backend calls per second per storage
+SCRUB_BURST = int(os.environ.get("SCRUB_BURST", 10))
+SCRUB_CONCURRENCY = int(os.environ.get("SCRUB_CONCURRENCY", 4))  # stat calls in flight
+SCRUB_SEGMENTS_PER_FETCH = int(os.environ.get("SCRUB_SEGMENTS_PER_FETCH", 4))
+
+_stop = threading.Event()
+_status = {
+    "passes": 0,
+    "files_checked": 0,
+    "shards_checked": 0,
+    "shards_lost": 0,
+    "shards_repaired": 0,
+    "unrecoverable_files": 0,
+    "repair_failures": 0,
+    "pass_started_at": None,
+    "last_pass_finished_at": None
+}
+_status_lock = threading.Lock()
+
+
+class _TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Block until a call is allowed."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _throttle(storage_id):
+    with _buckets_lock:
+        bucket = _buckets.setdefault(storage_id, _TokenBucket(SCRUB_RATE, SCRUB_BURST))
+    bucket.take()
+
+
+def _count(**amounts):
+    with _status_lock:
+        for name, amount in amounts.items():
+            _status[name] += amount
+
+
+def status():
+    with _status_lock:
+        return dict(_status)
+
+
+def _stat_task(shard, storage_type):
+    def check():
+        _throttle(shard.storage_id)
+        try:
+            with placement.observe(shard.storage_id):
+                info = get_backend(shard.storage_id, storage_type).stat(shard.shard_file_id)
+        except Exception as e:
+            # can't tell: neither good nor lost this time
+            print(f"Scrub: stat of shard {shard.shard_index} of file {shard.file_id} failed: {e}")
+            return None
+        if info is None:
+            return False
+        return shard.shard_size is None or info["size"] == shard.shard_size
+
+    return check
+
+
+def _block_ranges(file_row):
+    """(segments, start, end) windows covering a whole shard; legacy files are read whole in one go."""
+    if file_row.format_version != FORMAT_SEGMENTED:
+        return None, [(None, None, None)]
+    lengths = unpack_lengths(file_row.segment_lengths) if file_row.segment_lengths else None
+    layout = SegmentLayout(file_row.original_length, file_row.segment_size, file_row.required_shards, lengths)
+    windows = []
+    for first in range(0, layout.segment_count, SCRUB_SEGMENTS_PER_FETCH):
+        segments = range(first, min(first + SCRUB_SEGMENTS_PER_FETCH, layout.segment_count))
+        start = layout.block_offset(segments[0])
+        end = layout.block_offset(segments[-1]) + layout.block_size(segments[-1]) - 1
+        windows.append((segments, start, end))
+    return layout, windows
+
+
+def _fetch_task(shard, storage_type, layout, segments, start, end):
+    def fetch():
+        _throttle(shard.storage_id)
+        with placement.observe(shard.storage_id, 0 if start is None else end - start + 1):
+            data = get_backend(shard.storage_id, storage_type).get(shard.shard_file_id, start, end)
+        if start is not None and len(data) != end - start + 1:
+            raise ValueError(f"truncated shard {shard.shard_index}")
+        if segments and shard.block_checksums:
+            verify_blocks(layout, shard.block_checksums, segments, data)
+        return data
+
+    return fetch
+
+
+def rebuild_blocks(file_row, good, lost_indices, storage_types, sinks):
+    """Write the blocks of every lost shard index to its sink, reading k good shards window by window."""
+    k, n = file_row.required_shards, file_row.shard_count
+    sources = good[:k]
+    numbers = tuple(s.shard_index for s in sources)
+    layout, windows = _block_ranges(file_row)
+    decoder, encoder = zfec.Decoder(k, n), zfec.Encoder(k, n)
+
+    for segments, start, end in windows:
+        datas = run_all([
+            (f"Failed to read shard {s.shard_index}",
+             _fetch_task(s, storage_types[s.storage_id], layout, segments, start, end))
+            for s in sources
+        ], limit=k)
+        for i in segments or [None]:
+            if i is None:
+                blocks = datas
+            else:
+                offset = layout.block_offset(i) - start
+                blocks = [data[offset:offset + layout.block_size(i)] for data in datas]
+            primary = decoder.decode(tuple(blocks), numbers)
+            for index, block in zip(lost_indices, encoder.encode(tuple(primary), tuple(lost_indices))):
+                sinks[index].write(block)
+
+
+def repair_file(file_row, shards, storages, good, lost):
+    """Rebuild the shards in lost (FileShard rows) of file_row from k of the good ones and re-upload them."""
+    # storage_id -> storage_type for readable storages, None for the ones that need re-login
+    storage_types = {s.storage_id: s.storage_type if s.status in READABLE_STATUSES else None for s in storages}
+    lost_indices = [s.shard_index for s in lost]
+    sinks = {index: tempfile.TemporaryFile() for index in lost_indices}
+    uploaded = []
+    try:
+        rebuild_blocks(file_row, good, lost_indices, storage_types, sinks)
+
+        # lost shards go back where they were if that storage still takes uploads; the rest are placed again
+        active = {storage.storage_id for storage in storages if storage.status == "active"}
+        moving = [s for s in lost if s.storage_id not in active]
+        destinations = {s.shard_index: (s.storage_id, storage_types[s.storage_id]) for s in lost if s not in moving}
+        if moving:
+            held = {}
+            for s in shards:
+                if s not in moving:
+                    held[s.storage_id] = held.get(s.storage_id, 0) + 1
+            shard_size = sinks[moving[0].shard_index].seek(0, 2)
+            chosen = placement.replacements(file_row.group_id, file_row.required_shards, held, len(moving), shard_size)
+            for s, destination in zip(moving, chosen):
+                destinations[s.shard_index] = destination
+
+        rows = []
+        for s in lost:
+            storage_id, storage_type = destinations[s.shard_index]
+            sink = sinks[s.shard_index]
+            size = sink.seek(0, 2)
+            _throttle(storage_id)
+            with placement.observe(storage_id, size):
+                object_id = get_backend(storage_id, storage_type).put(sink, f"{file_row.filename}.shard{s.shard_index}")
+            uploaded.append((storage_id, object_id, storage_type))
+            rows.append((s, storage_id, object_id, size))
+
+        for s, storage_id, object_id, size in rows:
+            database.session.execute(
+                update(FileShard).where(FileShard.shard_id == s.shard_id)
+                .values(storage_id=storage_id, shard_file_id=object_id, folder_id="", shard_size=size)
+            )
+        database.session.commit()
+    except Exception:
+        database.session.rollback()
+        for storage_id, object_id, storage_type in uploaded:
+            try:
+                get_backend(storage_id, storage_type).delete(object_id)
+            except Exception as e:
+                print(f"Scrub: failed to remove rebuilt shard {object_id}: {e}")
+        raise
+    finally:
+        for sink in sinks.values():
+            sink.close()
+
+    # packed and deduplicated files read these shards too
+    file_manifest.clear()
+    # the old objects of shards that went missing in place may still linger as wrong-sized leftovers
+    for s in lost:
+        if s.storage_id in active:
+            _throttle(s.storage_id)
+            try:
+                get_backend(s.storage_id, storage_types[s.storage_id]).delete(s.shard_file_id)
+            except Exception:
+                pass
+    return len(rows)
+
+
+def scrub_batch(after=None):
+    """
+    Check the next SCRUB_BATCH_SIZE shard-owning files after file_id `after` and repair the ones
+    that need it. Returns the last file_id checked, or None at the end of the table.
+    Must run inside an app context.
+    """
+    query = File.query.filter(File.container_id.is_(None)).order_by(File.file_id)
+    if after is not None:
+        query = query.filter(File.file_id > after)
+    files = query.limit(SCRUB_BATCH_SIZE).all()
+    if not files:
+        return None
+
+    shards = FileShard.query.filter(FileShard.file_id.in_([f.file_id for f in files])).all()
+    storages = Storage.query.filter(Storage.storage_id.in_({s.storage_id for s in shards})).all()
+    # storage_id -> storage_type for readable storages, None for the ones that need re-login
+    storage_types = {s.storage_id: s.storage_type if s.status in READABLE_STATUSES else None for s in storages}
+    database.session.close()  # no connection held during the stat calls
+
+    checkable = [s for s in shards if storage_types.get(s.storage_id)]
+    results = run_all([
+        (f"Scrub shard {s.shard_index} of file {s.file_id}", _stat_task(s, storage_types[s.storage_id]))
+        for s in checkable
+    ], limit=SCRUB_CONCURRENCY)
+    health = {s.shard_id: result for s, result in zip(checkable, results)}
+    _count(files_checked=len(files), shards_checked=len(checkable))
+
+    by_file = {}
+    for s in shards:
+        by_file.setdefault(s.file_id, []).append(s)
+    for file_row in files:
+        file_shards = by_file.get(file_row.file_id, [])
+        good = [s for s in file_shards if health.get(s.shard_id)]
+        lost = [s for s in file_shards if health.get(s.shard_id, False) is False]
+        if not lost:
+            continue
+        _count(shards_lost=len(lost))
+        if len(good) >= file_row.required_shards + SCRUB_MIN_SPARE_SHARDS:
+            continue
+        if len(good) < file_row.required_shards:
+            print(f"Scrub: file {file_row.file_id} has {len(good)} good shards, needs {file_row.required_shards}")
+            _count(unrecoverable_files=1)
+            continue
+        try:
+            _count(shards_repaired=repair_file(file_row, file_shards, storages, good, lost))
+        except Exception as e:
+            print(f"Scrub: repair of file {file_row.file_id} failed: {e}")
+            _count(repair_failures=1)
+    return files[-1].file_id
+
+
+def scrub_all():
+    """One full sweep over every file, a batch at a time. Must run inside an app context."""
+    with _status_lock:
+        _status["pass_started_at"] = time.time()
+    after = None
+    while not _stop.is_set():
+        after = scrub_batch(after)
+        if after is None:
+            break
+        _stop.wait(SCRUB_BATCH_PAUSE)
+    with _status_lock:
+        _status["passes"] += 1
+        _status["last_pass_finished_at"] = time.time()
+
+
+def _run(app):
+    while not _stop.is_set():
+        with app.app_context():
+            try:
+                scrub_all()
+            except Exception as e:
+                print(f"Error in scrubber: {e}")
+        _stop.wait(SCRUB_PASS_INTERVAL)
+
+
+def start(app):
+    if not SCRUBBER_ENABLED:
+        return
+    _stop.clear()
+    threading.Thread(target=_run, args=(app,), name="scrubber", daemon=True).start()
+
+
+def stop():
+    _stop.set()
@@ -0,0 +1,217 @@
+"""
+Local cache of rebuilt segments, so files downloaded again and again skip the storages.
+
+What's cached is the output of the erasure decode: each segment's blob (nonce + ciphertext under
+the file's own key), keyed by (owner file id, segment index), plus the file key itself. A file
+whose key and segments are all here downloads without a single backend call; decryption (and
+decompression) still runs every time, so nothing in the cache is plaintext.
+
+Two tiers, each with a byte limit: an LRU in memory, and below it a directory of one file per
+segment, read back through mmap. Segments pushed out of memory go to disk, and disk hits move
+back up. File keys never touch the disk: they stay in memory wrapped under a random key made at
+startup, which also makes whatever a crashed process left on disk useless.
+
+Off unless SEGMENT_CACHE=1. Every worker process has its own cache; deletes invalidate the
+deleting process's, and others drop the file as it ages out (a deleted file has no manifest,
+so it can't be downloaded from a stale cache anyway).
+"""
+import atexit
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+SEGMENT_CACHE_ENABLED = os.environ.get("SEGMENT_CACHE", "0") == "1"
+SEGMENT_CACHE_MEMORY_BYTES = int(os.environ.get("SEGMENT_CACHE_MEMORY_BYTES", 256 * 1024 * 1024))
+SEGMENT_CACHE_DISK_BYTES = int(os.environ.get("SEGMENT_CACHE_DISK_BYTES", 4 * 1024 * 1024 * 1024))
+SEGMENT_CACHE_KEYS = int(os.environ.get("SEGMENT_CACHE_KEYS", 100000))  # file keys (~60 bytes each)
+SEGMENT_CACHE_DIR = os.environ.get("SEGMENT_CACHE_DIR") or tempfile.gettempdir()  # a per-process directory goes here
+
+_local_key = AESGCM(AESGCM.generate_key(bit_length=256))
+_lock = threading.Lock()
+_keys = OrderedDict()  # owner_id -> nonce + file key wrapped under _local_key
+_memory = OrderedDict()  # (owner_id, index) -> blob
+_memory_bytes = 0
+_disk = OrderedDict()  # (owner_id, index) -> blob length
+_disk_bytes = 0
+_disk_dir = None
+_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "key_hits": 0, "key_misses": 0,
+             "evictions": 0, "invalidations": 0}
+
+
+def _path(key):
+    owner_id, index = key
+    return os.path.join(_disk_dir, f"{owner_id.hex}-{index}")
+
+
+def _directory():
+    global _disk_dir
+    with _lock:
+        if _disk_dir is None:
+            _disk_dir = tempfile.mkdtemp(prefix="segment-cache-", dir=SEGMENT_CACHE_DIR)
+            atexit.register(shutil.rmtree, _disk_dir, True)
+        return _disk_dir
+
+
+def _unlink(keys):
+    for key in keys:
+        try:
+            os.remove(_path(key))
+        except FileNotFoundError:
+            pass
+
+
+def _write_disk(entries):
+    """Move blobs evicted from memory to the disk tier; returns the disk entries it pushed out in turn."""
+    global _disk_bytes
+    if SEGMENT_CACHE_DISK_BYTES <= 0 or not entries:
+        return []
+    _directory()
+    stored = []
+    for key, blob in entries:
+        if len(blob) > SEGMENT_CACHE_DISK_BYTES:
+            continue
+        # write then rename, so a reader never maps half a file
+        temporary = _path(key) + ".tmp"
+        try:
+            with open(temporary, "wb") as f:
+                f.write(blob)
+            os.replace(temporary, _path(key))
+        except OSError as e:
+            print(f"Segment cache: failed to write {_path(key)}: {e}")
+            continue
+        stored.append((key, len(blob)))
+
+    evicted = []
+    with _lock:
+        for key, length in stored:
+            _disk_bytes += length - _disk.pop(key, 0)
+            _disk[key] = length
+        while _disk_bytes > SEGMENT_CACHE_DISK_BYTES:
+            key, length = _disk.popitem(last=False)
+            _disk_bytes -= length
+            _counters["evictions"] += 1
+            evicted.append(key)
+    return evicted
+
+
+def _read_disk(key):
+    try:
+        with open(_path(key), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+    except (OSError, ValueError):
+        return None  # evicted (or invalidated) between the index lookup and the read
+
+
+def get(owner_id, index):
+    """The cached blob of segment index of owner_id's stripe, or None."""
+    key = (owner_id, index)
+    with _lock:
+        blob = _memory.get(key)
+        if blob is not None:
+            _memory.move_to_end(key)
+            _counters["memory_hits"] += 1
+            return blob
+        on_disk = key in _disk
+        if on_disk:
+            _disk.move_to_end(key)
+
+    blob = _read_disk(key) if on_disk else None
+    with _lock:
+        if blob is None:
+            _counters["misses"] += 1
+            return None
+        _counters["disk_hits"] += 1
+    put(owner_id, index, blob)
+    return blob
+
+
+def put(owner_id, index, blob):
+    """Cache a segment's blob in memory (pushing the least recently used ones down to disk)."""
+    global _memory_bytes
+    blob = bytes(blob)
+    key = (owner_id, index)
+    if len(blob) > SEGMENT_CACHE_MEMORY_BYTES:
+        _unlink(_write_disk([(key, blob)]))
+        return
+    demoted = []
+    with _lock:
+        _memory_bytes += len(blob) - len(_memory.pop(key, b""))
+        _memory[key] = blob
+        while _memory_bytes > SEGMENT_CACHE_MEMORY_BYTES:
+            demoted_key, demoted_blob = _memory.popitem(last=False)
+            _memory_bytes -= len(demoted_blob)
+            demoted.append((demoted_key, demoted_blob))
+    # already on disk from an earlier demotion: that copy is still good
+    with _lock:
+        demoted = [(k, b) for k, b in demoted if k not in _disk]
+    _unlink(_write_disk(demoted))
+
+
+def get_key(owner_id):
+    """owner_id's AES key, or None."""
+    with _lock:
+        wrapped = _keys.get(owner_id)
+        if wrapped is None:
+            _counters["key_misses"] += 1
+            return None
+        _keys.move_to_end(owner_id)
+        _counters["key_hits"] += 1
+    return _local_key.decrypt(wrapped[:12], wrapped[12:], owner_id.bytes)
+
+
+def put_key(owner_id, key_bytes):
+    nonce = os.urandom(12)
+    wrapped = nonce + _local_key.encrypt(nonce, bytes(key_bytes), owner_id.bytes)
+    with _lock:
+        _keys[owner_id] = wrapped
+        _keys.move_to_end(owner_id)
+        while len(_keys) > SEGMENT_CACHE_KEYS:
+            _keys.popitem(last=False)
+
+
+def discard(owner_id, index):
+    """Drop one segment from both tiers (e.g. one that failed to decrypt)."""
+    global _memory_bytes, _disk_bytes
+    key = (owner_id, index)
+    with _lock:
+        blob = _memory.pop(key, None)
+        if blob is not None:
+            _memory_bytes -= len(blob)
+        on_disk = key in _disk
+        if on_disk:
+            _disk_bytes -= _disk.pop(key)
+    if on_disk:
+        _unlink([key])
+
+
+def invalidate(owner_id):
+    """Drop owner_id's key and segments from both tiers."""
+    global _memory_bytes, _disk_bytes
+    with _lock:
+        _keys.pop(owner_id, None)
+        for key in [key for key in _memory if key[0] == owner_id]:
+            _memory_bytes -= len(_memory.pop(key))
+        on_disk = [key for key in _disk if key[0] == owner_id]
+        for key in on_disk:
+            _disk_bytes -= _disk.pop(key)
+        _counters["invalidations"] += 1
+    _unlink(on_disk)
+
+
+def stats():
+    """Hit/miss counters and tier sizes, for monitoring."""
+    with _lock:
+        lookups = _counters["memory_hits"] + _counters["disk_hits"] + _counters["misses"]
+        return {
+            "enabled": SEGMENT_CACHE_ENABLED,
+            **_counters,
+            "hit_rate": round((lookups - _counters["misses"]) / lookups, 4) if lookups else None,
+            "memory": {"segments": len(_memory), "bytes": _memory_bytes, "limit": SEGMENT_CACHE_MEMORY_BYTES},
+            "disk": {"segments": len(_disk), "bytes": _disk_bytes, "limit": SEGMENT_CACHE_DISK_BYTES},
+            "keys": len(_keys)
+        }
@@ -0,0 +1,232 @@
+import hashlib
+import os
+import struct
+import zfec
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import segment_compression
+
+# files.format_version values
+FORMAT_LEGACY = 1  # whole file: zfec(length prefix + nonce + ciphertext)
+FORMAT_SEGMENTED = 2  # fixed-size segments, each encrypted and erasure coded on its own
+
+SEGMENT_SIZE = int(os.environ.get("SEGMENT_SIZE", 4 * 1024 * 1024))  # plaintext bytes per segment
+NONCE_SIZE = 12
+TAG_SIZE = 16
+SEGMENT_OVERHEAD = NONCE_SIZE + TAG_SIZE
+CHECKSUM_SIZE = 8  # bytes of BLAKE2b per stored block (file_shards.block_checksums)
+
+
+def _div_ceil(a, b):
+    return (a + b - 1) // b
+
+
+def _segment_aad(index, is_last):
+    # binds each segment to its position so segments can't be reordered or the file truncated
+    return struct.pack(">QB", index, 1 if is_last else 0)
+
+
+class SegmentLayout:
+    """
+    Where every segment lives inside the shard objects.
+
+    Segment i is stored as nonce + AES-GCM(payload), padded to a multiple of k and split
+    into k primary blocks, then zfec expands it to n blocks of block_size(i) bytes. Shard j
+    is block j of segment 0, then block j of segment 1, and so on, so every shard has the same
+    length and the byte range of any segment inside a shard can be computed from the metadata.
+
+    The payload is the plaintext segment, or for compressed files a flag byte plus the
+    compressed segment; those vary in size, so payload_lengths (files.segment_lengths) is needed.
+    """
+
+    def __init__(self, original_length, segment_size, k, payload_lengths=None):
+        self.original_length = original_length
+        self.segment_size = segment_size
+        self.k = k
+        # an empty file is still one (empty) segment so it gets authenticated
+        self.segment_count = max(1, _div_ceil(original_length, segment_size))
+        self.payload_lengths = payload_lengths
+        self._offsets = None
+        if payload_lengths is not None:
+            if len(payload_lengths) != self.segment_count:
+                raise ValueError(f"expected {self.segment_count} segment lengths, got {len(payload_lengths)}")
+            self._offsets = [0]
+            for i in range(self.segment_count):
+                self._offsets.append(self._offsets[-1] + self.block_size(i))
+
+    def plain_length(self, index):
+        if index < self.segment_count - 1:
+            return self.segment_size
+        return self.original_length - self.segment_size * (self.segment_count - 1)
+
+    def payload_length(self, index):
+        if self.payload_lengths is not None:
+            return self.payload_lengths[index]
+        return self.plain_length(index)
+
+    def blob_length(self, index):
+        return self.payload_length(index) + SEGMENT_OVERHEAD
+
+    def block_size(self, index):
+        return _div_ceil(self.blob_length(index), self.k)
+
+    def block_offset(self, index):
+        """Offset of segment `index` inside every shard object."""
+        if self._offsets is not None:
+            return self._offsets[index]
+        return self.block_size(0) * index
+
+    def shard_length(self):
+        last = self.segment_count - 1
+        return self.block_offset(last) + self.block_size(last)
+
+    def segments_for_range(self, start, end):
+        """Segment indices that cover plaintext bytes start..end (inclusive)."""
+        return range(start // self.segment_size, end // self.segment_size + 1)
+
+
+def encrypt_segment(aes, index, is_last, plaintext):
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + aes.encrypt(nonce, bytes(plaintext), _segment_aad(index, is_last))
+
+
+def decrypt_segment(aes, index, is_last, blob):
+    nonce = blob[:NONCE_SIZE]
+    return aes.decrypt(nonce, blob[NONCE_SIZE:], _segment_aad(index, is_last))
+
+
+def encode_blob(blob, k, n):
+    """Split blob into k equal (zero padded) primary blocks and expand them to n blocks."""
+    size = _div_ceil(len(blob), k)
+    padded = bytes(blob).ljust(size * k, b"\x00")
+    primary = [padded[i * size:(i + 1) * size] for i in range(k)]
+    return zfec.Encoder(k, n).encode(primary)
+
+
+def decode_blob(blocks, block_numbers, k, n, blob_length):
+    primary = zfec.Decoder(k, n).decode(blocks, block_numbers)
+    return b"".join(primary)[:blob_length]
+
+
+def block_checksum(block):
+    return hashlib.blake2b(block, digest_size=CHECKSUM_SIZE).digest()
+
+
+def verify_blocks(layout, checksums, segments, data):
+    """
+    Check the blocks of consecutive segments fetched from one shard (data starts at the first
+    segment's block) against that shard's block_checksums; raises ValueError on a mismatch.
+    """
+    base = layout.block_offset(segments[0])
+    for i in segments:
+        offset = layout.block_offset(i) - base
+        expected = checksums[i * CHECKSUM_SIZE:(i + 1) * CHECKSUM_SIZE]
+        if block_checksum(data[offset:offset + layout.block_size(i)]) != expected:
+            raise ValueError(f"checksum mismatch in segment {i}")
+
+
+def pack_lengths(lengths):
+    return struct.pack(f">{len(lengths)}I", *lengths)
+
+
+def unpack_lengths(data):
+    return list(struct.unpack(f">{len(data) // 4}I", data))
+
+
+def encode_segment(key, k, n, index, is_last, plaintext, compression=None):
+    """
+    (Compress,) encrypt and erasure code one plaintext segment.
+    compression is (codec, level) or None. Returns (n blocks, payload length).
+    """
+    payload = plaintext if compression is None else segment_compression.pack_segment(*compression, plaintext)
+    return encode_blob(encrypt_segment(AESGCM(key), index, is_last, payload), k, n), len(payload)
+
+
+class SegmentEncoder:
+    """
+    Incremental encrypt + erasure code pipeline.
+
+    Plaintext is fed in any chunk size; every full segment is encrypted, encoded and its
+    n blocks appended to the n shard sinks (file-like objects) right away, so only about
+    one segment plus its n encoded blocks are ever held in memory.
+    encode(key, k, n, index, is_last, plaintext, compression) does the per-segment work (see codec_executor).
+
+    compression is (codec, level) or None; it's dropped if the first segment doesn't compress,
+    so check .codec after finish() for what was actually used.
+    """
+
+    def __init__(self, key, k, n, sinks, segment_size=SEGMENT_SIZE, encode=encode_segment, compression=None):
+        if len(sinks) != n:
+            raise ValueError(f"expected {n} shard sinks, got {len(sinks)}")
+        self.key = key
+        self.encode = encode
+        self.compression = compression
+        self.payload_lengths = []
+        self.k = k
+        self.n = n
+        self.sinks = sinks
+        self.segment_size = segment_size
+        self.buffer = bytearray()
+        self.segment_index = 0
+        self.total_length = 0
+        self.hasher = hashlib.sha256()  # content hash for deduplication
+        self.block_checksums = [bytearray() for _ in range(n)]  # per shard, one checksum per segment
+
+    def feed(self, data):
+        self.buffer += data
+        self.total_length += len(data)
+        self.hasher.update(data)
+        # hold back the last segment: it can only be encoded once we know it's the last one
+        while len(self.buffer) > self.segment_size:
+            self._emit(self.buffer[:self.segment_size], is_last=False)
+            del self.buffer[:self.segment_size]
+
+    def feed_stream(self, stream, chunk_size=None, progress=None):
+        chunk_size = chunk_size or self.segment_size
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            self.feed(chunk)
+            if progress:
+                progress(len(chunk))
+
+    @property
+    def content_hash(self):
+        return self.hasher.digest()
+
+    @property
+    def codec(self):
+        return self.compression[0] if self.compression else None
+
+    def finish(self):
+        self._emit(self.buffer, is_last=True)
+        self.buffer = bytearray()
+        return SegmentLayout(self.total_length, self.segment_size, self.k,
+                             self.payload_lengths if self.compression else None)
+
+    def _emit(self, plaintext, is_last):
+        if self.segment_index == 0 and self.compression:
+            if not segment_compression.worth_compressing(self.codec, plaintext):
+                self.compression = None
+
+        blocks, payload_length = self.encode(self.key, self.k, self.n, self.segment_index, is_last,
+                                             bytes(plaintext), self.compression)
+        for sink, checksums, block in zip(self.sinks, self.block_checksums, blocks):
+            sink.write(block)
+            checksums += block_checksum(block)
+        self.payload_lengths.append(payload_length)
+        self.segment_index += 1
+
+
+def decode_segment(aes, layout, index, blocks, block_numbers, n, codec=None):
+    """Rebuild, decrypt (and decompress, for files stored with a codec) one segment from k of its blocks."""
+    blob = decode_blob(blocks, block_numbers, layout.k, n, layout.blob_length(index))
+    return open_blob(aes, layout, index, blob, codec)
+
+
+def open_blob(aes, layout, index, blob, codec=None):
+    """Decrypt (and decompress) one segment's rebuilt blob (nonce + ciphertext)."""
+    payload = decrypt_segment(aes, index, index == layout.segment_count - 1, blob)
+    if codec is None:
+        return payload
+    return segment_compression.unpack_segment(codec, payload, layout.plain_length(index))
@@ -0,0 +1,79 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional: groups asking for zstd get zlib instead
+    zstandard = None
+
+# first byte of every segment payload of a compressed file
+FLAG_STORED = 0  # segment didn't shrink, kept as is
+FLAG_COMPRESSED = 1
+
+SAMPLE_SIZE = 64 * 1024  # bytes of the first segment test-compressed before committing to a codec
+SAMPLE_MIN_SAVING = 0.05  # the sample must shrink by at least this much
+
+DEFAULT_LEVELS = {"zlib": 6, "zstd": 3}
+LEVEL_RANGES = {"zlib": (-1, 9), "zstd": (1, 22)}  # inclusive
+
+
+def available_codec(codec):
+    """The codec that will actually be used for `codec` ("zstd", "zlib" or None)."""
+    if codec == "zstd" and zstandard is None:
+        return "zlib"
+    return codec if codec in DEFAULT_LEVELS else None
+
+
+def valid_level(codec, level):
+    """Whether level (an int, not a bool) is within codec's range."""
+    if isinstance(level, bool) or not isinstance(level, int):
+        return False
+    low, high = LEVEL_RANGES[codec]
+    return low <= level <= high
+
+
+def compress(codec, level, data):
+    # clamp rather than fail: a level stored before it was validated mustn't block uploads
+    low, high = LEVEL_RANGES[codec]
+    level = min(max(level, low), high)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def decompress(codec, data, max_length):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_length)
+    decompressor = zlib.decompressobj()
+    plaintext = decompressor.decompress(data, max_length)
+    if decompressor.unconsumed_tail:
+        raise ValueError("segment decompresses to more than its recorded length")
+    return plaintext
+
+
+def worth_compressing(codec, sample):
+    """Quick check on the start of a file: skip compression for data that's already compressed."""
+    sample = bytes(sample[:SAMPLE_SIZE])
+    if not sample:
+        return False
+    # the cheapest level is enough to tell text from media / archives
+    return len(compress(codec, 1, sample)) <= len(sample) * (1 - SAMPLE_MIN_SAVING)
+
+
+def pack_segment(codec, level, plaintext):
+    """Segment payload: flag byte, then the compressed segment, or the segment as is if that isn't smaller."""
+    compressed = compress(codec, level, plaintext)
+    if len(compressed) < len(plaintext):
+        return bytes([FLAG_COMPRESSED]) + compressed
+    return bytes([FLAG_STORED]) + bytes(plaintext)
+
+
+def unpack_segment(codec, payload, plain_length):
+    if payload[0] == FLAG_STORED:
+        plaintext = payload[1:]
+    elif payload[0] == FLAG_COMPRESSED:
+        plaintext = decompress(codec, payload[1:], plain_length)
+    else:
+        raise ValueError(f"unknown segment flag {payload[0]}")
+    if len(plaintext) != plain_length:
+        raise ValueError(f"segment should be {plain_length} bytes, got {len(plaintext)}")
+    return plaintext
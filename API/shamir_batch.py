@@ -0,0 +1,214 @@
+"""
+Batched Shamir secret sharing, share-compatible with Crypto.Protocol.SecretSharing.Shamir.
+
+Same field as pycryptodome (GF(2^128), polynomial 1 + x + x^2 + x^7 + x^128, 16-byte blocks read
+as big-endian integers), same x = 1..m share indices and the same polynomial, so shares made
+here combine with Shamir.combine and the other way round. 32-byte AES keys are split as two
+independent 16-byte halves and stored as index byte + half1 share + half2 share, exactly like
+the original upload path.
+
+It's faster because share indices are small integers: evaluating the polynomial at x only
+needs carry-less multiplication by an 8-bit value, and combining reuses one set of Lagrange
+coefficients (with 4-bit lookup tables) for every key that was split over the same indices.
+"""
+from functools import lru_cache
+from Crypto.Random import get_random_bytes
+
+BLOCK = 16  # bytes per field element
+_MASK = (1 << 128) - 1
+_REDUCTION = 0x87  # x^7 + x^2 + x + 1: what x^128 folds back to
+
+
+def _clmul(a, b):
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        b >>= 1
+        a <<= 1
+    return product
+
+
+# h * x^128 for every h < 2^8: what the overflow of a product with an 8-bit value folds back to
+_FOLD = [_clmul(h, _REDUCTION) for h in range(256)]
+
+
+def _reduce_small(v):
+    # v * x (x < 256) overflows by at most 7 bits, and h * 0x87 stays below 2^14, so one fold is enough
+    return (v & _MASK) ^ _FOLD[v >> 128]
+
+
+def _mul_small(v, x):
+    """v * x for a field element v and a small (< 256) x."""
+    return _reduce_small(_clmul(v, x))
+
+
+def _mul(a, b):
+    """General GF(2^128) multiplication (shift and add); used where there's nothing to amortize."""
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        b >>= 1
+        a <<= 1
+        if a >> 128:
+            a = (a & _MASK) ^ _REDUCTION
+    return product
+
+
+def _inverse(a):
+    """Extended Euclid over GF(2)[x] modulo the field polynomial."""
+    if a == 0:
+        raise ValueError("Inversion of zero")
+    r0, r1 = a, _MASK + 1 | _REDUCTION
+    s0, s1 = 1, 0
+    while r1:
+        # polynomial long division r0 / r1
+        q, r = 0, r0
+        while r.bit_length() >= r1.bit_length():
+            shift = r.bit_length() - r1.bit_length()
+            q ^= 1 << shift
+            r ^= r1 << shift
+        r0, r1 = r1, r
+        s0, s1 = s1, s0 ^ _clmul(q, s1)
+    return s0
+
+
+class _Multiplier:
+    """Multiplication by a fixed element c with 32 tables of 16 entries (one per 4-bit window)."""
+
+    def __init__(self, c):
+        self.tables = []
+        base = c
+        for _ in range(32):
+            powers = [base]
+            for _ in range(3):
+                powers.append(_mul_small(powers[-1], 2))
+            row = [0] * 16
+            for nibble in range(1, 16):
+                low = nibble & -nibble
+                row[nibble] = row[nibble ^ low] ^ powers[low.bit_length() - 1]
+            self.tables.append(row)
+            base = _mul_small(powers[3], 2)  # c * x^(4 * (window + 1))
+
+    def __call__(self, v):
+        result = 0
+        for row in self.tables:
+            result ^= row[v & 15]
+            v >>= 4
+        return result
+
+
+@lru_cache(maxsize=256)
+def _weights(xs):
+    # shares are nearly always fetched over the same few index sets, so keep their multipliers around
+    return [_Multiplier(c) for c in _lagrange(xs)]
+
+
+def _lagrange(xs, at=0):
+    """Coefficients l_j(at) for interpolating through the points with x coordinates xs."""
+    if len(set(xs)) != len(xs):
+        raise ValueError("Duplicate share")
+    coefficients = []
+    for j, x_j in enumerate(xs):
+        numerator, denominator = 1, 1
+        for m, x_m in enumerate(xs):
+            if m != j:
+                numerator = _mul(numerator, at ^ x_m)
+                denominator = _mul(denominator, x_j ^ x_m)
+        coefficients.append(_mul(numerator, _inverse(denominator)))
+    return coefficients
+
+
+def split_secrets(secrets, t, m):
+    """
+    Split many secrets (each a multiple of 16 bytes) with threshold t into m shares.
+    Returns one list per secret of m (index, share) tuples, index 1..m, share as long as the secret.
+    """
+    if not 1 <= t <= m <= 255:
+        raise ValueError("Need 1 <= t <= m <= 255")
+    blocks = []
+    for secret in secrets:
+        if not secret or len(secret) % BLOCK:
+            raise ValueError(f"Secret must be a non-empty multiple of {BLOCK} bytes, got {len(secret)}")
+        blocks.append([int.from_bytes(secret[i:i + BLOCK], "big") for i in range(0, len(secret), BLOCK)])
+
+    # all random coefficients for the batch in one call
+    random = get_random_bytes(BLOCK * (t - 1) * sum(len(b) for b in blocks))
+    position = 0
+
+    result = []
+    for secret_blocks in blocks:
+        shares = [bytearray() for _ in range(m)]
+        for value in secret_blocks:
+            # p(x) = c_(t-1) x^(t-1) + ... + c_1 x + secret, highest coefficient first for Horner
+            coefficients = []
+            for _ in range(t - 1):
+                coefficients.append(int.from_bytes(random[position:position + BLOCK], "big"))
+                position += BLOCK
+            coefficients.append(value)
+            for x in range(1, m + 1):
+                y = 0
+                for c in coefficients:
+                    y = _mul_small(y, x) ^ c
+                shares[x - 1] += y.to_bytes(BLOCK, "big")
+        result.append([(x, bytes(shares[x - 1])) for x in range(1, m + 1)])
+    return result
+
+
+def combine_secrets(share_sets):
+    """
+    Recombine many secrets; share_sets holds, per secret, exactly t (index, share) tuples.
+    Secrets shared over the same indices reuse one set of Lagrange multipliers.
+    """
+    secrets = []
+    for shares in share_sets:
+        weights = _weights(tuple(index for index, _ in shares))
+
+        length = len(shares[0][1])
+        if length % BLOCK or any(len(share) != length for _, share in shares):
+            raise ValueError(f"Shares must all be the same multiple of {BLOCK} bytes")
+
+        secret = bytearray()
+        for offset in range(0, length, BLOCK):
+            value = 0
+            for weight, (_, share) in zip(weights, shares):
+                value ^= weight(int.from_bytes(share[offset:offset + BLOCK], "big"))
+            secret += value.to_bytes(BLOCK, "big")
+        secrets.append(bytes(secret))
+    return secrets
+
+
+def split_key(key, t, m):
+    """Split one AES key; see split_secrets."""
+    return split_secrets([key], t, m)[0]
+
+
+def combine_key(shares):
+    """Recombine one AES key from exactly t (index, share) tuples; see combine_secrets."""
+    return combine_secrets([shares])[0]
+
+
+def derive_shares(shares, xs):
+    """
+    New shares at indices xs of the secret behind exactly t (index, share) tuples, e.g. to
+    replace lost shares; they lie on the same polynomial, so they combine with the old ones.
+    """
+    known = tuple(index for index, _ in shares)
+    length = len(shares[0][1])
+    if length % BLOCK or any(len(share) != length for _, share in shares):
+        raise ValueError(f"Shares must all be the same multiple of {BLOCK} bytes")
+
+    result = []
+    for x in xs:
+        if not 1 <= x <= 255:
+            raise ValueError("Share index must be between 1 and 255")
+        weights = _lagrange(known, at=x)
+        share = bytearray()
+        for offset in range(0, length, BLOCK):
+            value = 0
+            for weight, (_, old) in zip(weights, shares):
+                value ^= _mul(weight, int.from_bytes(old[offset:offset + BLOCK], "big"))
+            share += value.to_bytes(BLOCK, "big")
+        result.append((x, bytes(share)))
+    return result
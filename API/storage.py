@@ -1,6 +1,9 @@
 from sqlalchemy import Enum, func, Text
 from database import database
 
+# draining storages are being evacuated: still read from, no longer written to
+READABLE_STATUSES = ("active", "draining")
+
 
 class Storage(database.Model):
     __tablename__ = 'storage'
@@ -9,11 +12,12 @@ class Storage(database.Model):
     group_id = database.Column(database.Integer, nullable=False)
     account_id = database.Column(database.Integer, nullable=False)
     storage_type = database.Column(
-        Enum('google_drive', 'dropbox', name='storage_type_enum'),
+        Enum('google_drive', 'dropbox', 'local', 'memory', name='storage_type_enum'),
         nullable=False
     )
     refresh_token = database.Column(Text, nullable=True)
     token = database.Column(Text, nullable=True)
+    token_expiry = database.Column(database.DateTime, nullable=True)  # UTC, as google-auth reports it
     token_uri = database.Column(Text, nullable=True)
     client_id = database.Column(Text, nullable=True)
     client_secret = database.Column(Text, nullable=True)
@@ -21,3 +25,6 @@ class Storage(database.Model):
     last_login = database.Column(database.DateTime, default=func.now())
     name = database.Column(database.String(255), nullable=True)
     email = database.Column(database.String(255), nullable=True)
+    # active, needs_relogin once the refresh token has been revoked/expired,
+    # draining while it's being evacuated and retired once nothing is left on it
+    status = database.Column(database.String(20), nullable=False, default="active")
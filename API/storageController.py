@@ -4,10 +4,14 @@ from google_auth_oauthlib.flow import Flow
 from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 import requests as http_requests
+from sqlalchemy import update
+from sqlalchemy.orm import Session
 import os
 import pathlib
 from database import database
 from storage import Storage
+import credential_cache
+import file_manifest
 
 os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"  # only for local testing
 GOOGLE_CLIENT_SECRETS_FILE = str(pathlib.Path(__file__).parent / "credentials.json")
@@ -40,32 +44,58 @@ class StorageController:
         return redirect(auth_url)
 
     @staticmethod
-    def get_google_creds(storage_id):
-        storage = Storage.query.filter_by(storage_id=storage_id).first()
-        if not storage:
-            return None
+    def get_drive_service(storage_id):
+        return credential_cache.get_drive_service(storage_id, StorageController.load_google_creds)
 
-        creds = Credentials(
+    @staticmethod
+    def build_google_creds(storage):
+        return Credentials(
             token=storage.token,
             refresh_token=storage.refresh_token,
             token_uri=storage.token_uri,
             client_id=storage.client_id,
             client_secret=storage.client_secret,
-            scopes=storage.scopes.split(",")
+            scopes=storage.scopes.split(","),
+            expiry=storage.token_expiry
         )
 
+    @staticmethod
+    def load_google_creds(storage_id):
+        # uncached: use get_drive_service unless you really need a fresh copy from the database
+        # own short session: this runs inside transfer tasks, and the connection shouldn't stay
+        # checked out for the token refresh and the upload that follow
+        with Session(database.engine) as db_session:
+            storage = db_session.get(Storage, storage_id)
+            if not storage or storage.status == "needs_relogin":
+                return None
+            creds = StorageController.build_google_creds(storage)
+
+        # normally token_refresher has already done this; only a cold cache gets here with an old token
         if creds.expired and creds.refresh_token:
-            # refresh token
             try:
                 creds.refresh(Request())
             except RefreshError:
-                return None  # note: later, make it so that user need to re-login
+                StorageController.mark_needs_relogin([storage_id])
+                return None
 
-            # save new token
-            storage.token = creds.token
-            database.session.commit()
+            # new token is saved with the next credential_cache.flush_tokens()
+            credential_cache.queue_token(storage_id, creds)
         return creds
 
+    @staticmethod
+    def mark_needs_relogin(storage_ids):
+        """Flag storages whose refresh token stopped working so no more work is sent to them."""
+        for storage_id in storage_ids:
+            credential_cache.invalidate(storage_id)
+        file_manifest.clear()  # cached manifests still think these storages are active
+
+        # own session: this can happen in the middle of someone else's request
+        with Session(database.engine) as db_session:
+            db_session.execute(
+                update(Storage).where(Storage.storage_id.in_(storage_ids)).values(status="needs_relogin")
+            )
+            db_session.commit()
+
     @staticmethod
     def oauth_callback():
         flow = Flow.from_client_secrets_file(
@@ -87,24 +117,32 @@ class StorageController:
         email = user_info.get("email")
         name = session.get("storage_name") or "Default Name"
 
-        # Save storage record
-        storage = Storage(
-            group_id=1,
-            account_id=1,
-            name=name,
-            email=email,
-            storage_type="google_drive",
-            refresh_token=creds.refresh_token,
-            token=creds.token,
-            token_uri=creds.token_uri,
-            client_id=creds.client_id,
-            client_secret=creds.client_secret,
-            scopes=",".join(creds.scopes),
-        )
-
-        database.session.add(storage)
+        # logging in again to a drive we already have renews its credentials instead of adding a second storage
+        # (retired storages are done with; that drive comes back as a new one)
+        storage = Storage.query.filter(
+            Storage.group_id == 1,
+            Storage.email == email,
+            Storage.storage_type == "google_drive",
+            Storage.status != "retired"
+        ).order_by(Storage.storage_id).first() if email else None
+        if storage is None:
+            storage = Storage(group_id=1, account_id=1, name=name, email=email, storage_type="google_drive")
+            database.session.add(storage)
+
+        storage.refresh_token = creds.refresh_token or storage.refresh_token
+        storage.token = creds.token
+        storage.token_expiry = creds.expiry
+        storage.token_uri = creds.token_uri
+        storage.client_id = creds.client_id
+        storage.client_secret = creds.client_secret
+        storage.scopes = ",".join(creds.scopes)
+        if storage.status == "needs_relogin":
+            storage.status = "active"
         database.session.commit()
 
+        credential_cache.invalidate(storage.storage_id)
+        file_manifest.clear()  # cached manifests still think the storage needs re-login
+
         session["storage_id"] = storage.storage_id
 
         return f"Login successful! Connected as {email}"
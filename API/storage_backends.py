@@ -0,0 +1,308 @@
+import asyncio
+import os
+import pathlib
+import random
+import shutil
+import threading
+import time
+from io import BytesIO
+from uuid import uuid4
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from storageController import StorageController
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # resumable upload chunk size for large shards
+LOCAL_STORAGE_ROOT = os.environ.get("LOCAL_STORAGE_ROOT", str(pathlib.Path(__file__).parent / "local_storage"))
+
+# storage_type -> backend class
+_BACKENDS = {}
+
+
+def register_backend(storage_type):
+    """Class decorator: use this backend for Storage rows with the given storage_type."""
+    def register(cls):
+        _BACKENDS[storage_type] = cls
+        return cls
+
+    return register
+
+
+def get_backend(storage_id, storage_type=None):
+    """Backend for a storage; pass storage_type when it's already known to skip the lookup."""
+    if storage_type is None:
+        storage_type = StorageController.get_storage_info(storage_id).storage_type
+
+    backend = _BACKENDS.get(storage_type)
+    if backend is None:
+        raise ValueError(f"Unsupported storage type: {storage_type}")
+    return backend(storage_id)
+
+
+def _read_all(data):
+    if hasattr(data, "read"):
+        data.seek(0)
+        return data.read()
+    return bytes(data)
+
+
+class StorageBackend:
+    """
+    Common interface for everything that can hold shards and key shares.
+
+    data passed to put() is bytes or a seekable file object. get() returns bytes, optionally
+    only start..end (inclusive). stat() returns {"size": ...} or None if the object is gone.
+    quota() returns {"total": ..., "used": ...} in bytes, or None if the storage has no known limit.
+    The a* methods are the asyncio versions; by default they run the blocking call in a thread.
+    """
+
+    def __init__(self, storage_id):
+        self.storage_id = storage_id
+
+    def put(self, data, name, folder_id=None):
+        raise NotImplementedError
+
+    def get(self, object_id, start=None, end=None):
+        raise NotImplementedError
+
+    def delete(self, object_id):
+        raise NotImplementedError
+
+    def stat(self, object_id):
+        raise NotImplementedError
+
+    def quota(self):
+        return None
+
+    async def aput(self, data, name, folder_id=None):
+        return await asyncio.to_thread(self.put, data, name, folder_id)
+
+    async def aget(self, object_id, start=None, end=None):
+        return await asyncio.to_thread(self.get, object_id, start, end)
+
+    async def adelete(self, object_id):
+        return await asyncio.to_thread(self.delete, object_id)
+
+    async def astat(self, object_id):
+        return await asyncio.to_thread(self.stat, object_id)
+
+
+@register_backend("google_drive")
+class GoogleDriveBackend(StorageBackend):
+
+    def _drive(self):
+        drive = StorageController.get_drive_service(self.storage_id)
+        if not drive:
+            raise Exception("Google Drive credentials missing or expired")
+        return drive
+
+    def put(self, data, name, folder_id=None):
+        if hasattr(data, "read"):
+            # spooled shard file: stream it up in chunks instead of loading it into memory
+            data.seek(0)
+            media = MediaIoBaseUpload(data, mimetype="application/octet-stream",
+                                      chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        else:
+            media = MediaIoBaseUpload(BytesIO(data), mimetype="application/octet-stream")
+
+        metadata = {"name": name}
+        if folder_id:
+            metadata["parents"] = [folder_id]
+
+        uploaded = self._drive().files().create(
+            body=metadata, media_body=media, fields="id"
+        ).execute()
+
+        return uploaded["id"]
+
+    def get(self, object_id, start=None, end=None):
+        download_request = self._drive().files().get_media(fileId=object_id)
+
+        if start is not None:
+            # partial download: only the bytes between start and end (inclusive)
+            download_request.headers["Range"] = f"bytes={start}-{end}"
+            return download_request.execute()
+
+        buffer = BytesIO()
+        downloader = MediaIoBaseDownload(buffer, download_request)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+
+        return buffer.getvalue()
+
+    def delete(self, object_id):
+        self._drive().files().delete(fileId=object_id).execute()
+
+    def stat(self, object_id):
+        try:
+            info = self._drive().files().get(fileId=object_id, fields="id,size,trashed").execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                return None
+            raise
+        if info.get("trashed"):
+            return None
+        return {"size": int(info.get("size", 0))}
+
+    def quota(self):
+        quota = self._drive().about().get(fields="storageQuota(limit,usage)").execute()["storageQuota"]
+        if "limit" not in quota:  # unlimited (e.g. some workspace accounts)
+            return None
+        return {"total": int(quota["limit"]), "used": int(quota["usage"])}
+
+
+@register_backend("local")
+class LocalDirectoryBackend(StorageBackend):
+    """Objects are plain files under LOCAL_STORAGE_ROOT/<storage_id>/ (folder_id is ignored)."""
+
+    def __init__(self, storage_id):
+        super().__init__(storage_id)
+        self.root = pathlib.Path(LOCAL_STORAGE_ROOT) / str(storage_id)
+
+    def _path(self, object_id):
+        # object ids are generated by put(); never let one escape the storage directory
+        if not object_id or "/" in object_id or "\\" in object_id or object_id.startswith("."):
+            raise ValueError(f"Invalid object id: {object_id}")
+        return self.root / object_id
+
+    def put(self, data, name, folder_id=None):
+        self.root.mkdir(parents=True, exist_ok=True)
+        object_id = uuid4().hex
+        temp_path = self.root / f".{object_id}.tmp"
+        with open(temp_path, "wb") as out:
+            if hasattr(data, "read"):
+                data.seek(0)
+                shutil.copyfileobj(data, out, UPLOAD_CHUNK_SIZE)
+            else:
+                out.write(data)
+        os.replace(temp_path, self._path(object_id))
+        return object_id
+
+    def get(self, object_id, start=None, end=None):
+        with open(self._path(object_id), "rb") as f:
+            if start is None:
+                return f.read()
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def delete(self, object_id):
+        self._path(object_id).unlink(missing_ok=True)
+
+    def stat(self, object_id):
+        try:
+            return {"size": self._path(object_id).stat().st_size}
+        except FileNotFoundError:
+            return None
+
+    def quota(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        usage = shutil.disk_usage(self.root)
+        return {"total": usage.total, "used": usage.total - usage.free}
+
+
+@register_backend("memory")
+class MemoryBackend(StorageBackend):
+    """
+    Process-local backend for benchmarks and load tests.
+    Every call waits `latency` (+/- `jitter`) seconds and fails with probability `failure_rate`;
+    set them with configure() or MEMORY_BACKEND_LATENCY / _JITTER / _FAILURE_RATE.
+    `capacity` bytes per storage (0: unlimited) is what quota() reports.
+    """
+
+    latency = float(os.environ.get("MEMORY_BACKEND_LATENCY", 0))
+    jitter = float(os.environ.get("MEMORY_BACKEND_JITTER", 0))
+    failure_rate = float(os.environ.get("MEMORY_BACKEND_FAILURE_RATE", 0))
+    capacity = int(os.environ.get("MEMORY_BACKEND_CAPACITY", 0))
+
+    _objects = {}  # (storage_id, object_id) -> bytes
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, latency=None, jitter=None, failure_rate=None, capacity=None):
+        if latency is not None:
+            cls.latency = latency
+        if jitter is not None:
+            cls.jitter = jitter
+        if failure_rate is not None:
+            cls.failure_rate = failure_rate
+        if capacity is not None:
+            cls.capacity = capacity
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._objects.clear()
+
+    def _delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def _maybe_fail(self, operation):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise IOError(f"injected {operation} failure on memory storage {self.storage_id}")
+
+    def _put(self, data):
+        self._maybe_fail("put")
+        object_id = uuid4().hex
+        with self._lock:
+            self._objects[(self.storage_id, object_id)] = _read_all(data)
+        return object_id
+
+    def _get(self, object_id, start, end):
+        self._maybe_fail("get")
+        with self._lock:
+            data = self._objects.get((self.storage_id, object_id))
+        if data is None:
+            raise KeyError(f"No object {object_id} on memory storage {self.storage_id}")
+        return data if start is None else data[start:end + 1]
+
+    def _delete(self, object_id):
+        self._maybe_fail("delete")
+        with self._lock:
+            self._objects.pop((self.storage_id, object_id), None)
+
+    def _stat(self, object_id):
+        self._maybe_fail("stat")
+        with self._lock:
+            data = self._objects.get((self.storage_id, object_id))
+        return None if data is None else {"size": len(data)}
+
+    def put(self, data, name, folder_id=None):
+        time.sleep(self._delay())
+        return self._put(data)
+
+    def get(self, object_id, start=None, end=None):
+        time.sleep(self._delay())
+        return self._get(object_id, start, end)
+
+    def delete(self, object_id):
+        time.sleep(self._delay())
+        self._delete(object_id)
+
+    def stat(self, object_id):
+        time.sleep(self._delay())
+        return self._stat(object_id)
+
+    def quota(self):
+        if not self.capacity:
+            return None
+        with self._lock:
+            used = sum(len(data) for (storage_id, _), data in self._objects.items() if storage_id == self.storage_id)
+        return {"total": self.capacity, "used": used}
+
+    # the async versions sleep on the event loop instead of tying up a thread
+
+    async def aput(self, data, name, folder_id=None):
+        await asyncio.sleep(self._delay())
+        return self._put(data)
+
+    async def aget(self, object_id, start=None, end=None):
+        await asyncio.sleep(self._delay())
+        return self._get(object_id, start, end)
+
+    async def adelete(self, object_id):
+        await asyncio.sleep(self._delay())
+        self._delete(object_id)
+
+    async def astat(self, object_id):
+        await asyncio.sleep(self._delay())
+        return self._stat(object_id)
@@ -0,0 +1,72 @@
+"""
+Shares made by shamir_batch must stay interchangeable with pycryptodome's Shamir: the key shares
+of files uploaded before it replaced the per-file path were made by pycryptodome.
+
+    cd API
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+
+import pytest
+from Crypto.Protocol.SecretSharing import Shamir
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shamir_batch import combine_key, combine_secrets, derive_shares, split_key, split_secrets
+
+THRESHOLDS = [(1, 1), (2, 3), (3, 5), (5, 8)]
+
+
+def _pycryptodome_split(key, t, m):
+    # the old upload path: each 16-byte half split on its own, stored as half1 share + half2 share
+    first, second = Shamir.split(t, m, key[:16]), Shamir.split(t, m, key[16:])
+    return [(index, a + b) for (index, a), (_, b) in zip(first, second)]
+
+
+def _pycryptodome_combine(shares):
+    return (Shamir.combine([(index, share[:16]) for index, share in shares]) +
+            Shamir.combine([(index, share[16:]) for index, share in shares]))
+
+
+@pytest.mark.parametrize("t,m", THRESHOLDS)
+def test_batch_shares_combine_with_pycryptodome(t, m):
+    key = os.urandom(32)
+    shares = split_key(key, t, m)
+    assert [index for index, _ in shares] == list(range(1, m + 1))
+    assert _pycryptodome_combine(random.sample(shares, t)) == key
+
+
+@pytest.mark.parametrize("t,m", THRESHOLDS)
+def test_pycryptodome_shares_combine_with_batch(t, m):
+    key = os.urandom(32)
+    shares = _pycryptodome_split(key, t, m)
+    assert combine_key(random.sample(shares, t)) == key
+
+
+def test_batch_round_trip_over_many_secrets():
+    keys = [os.urandom(32) for _ in range(20)]
+    share_sets = split_secrets(keys, 3, 5)
+    # the same index set for several keys exercises the cached Lagrange multipliers
+    assert combine_secrets([shares[1:4] for shares in share_sets]) == keys
+    assert combine_secrets([random.sample(shares, 3) for shares in share_sets]) == keys
+
+
+@pytest.mark.parametrize("split", [split_key, _pycryptodome_split])
+def test_derived_shares_lie_on_the_same_polynomial(split):
+    key = os.urandom(32)
+    shares = split(key, 3, 6)
+    # rebuilding shares 5 and 6 from shares 1..3 must give back exactly the originals
+    assert derive_shares(shares[:3], [5, 6]) == shares[4:6]
+
+    new = derive_shares(shares[1:4], [7, 200])
+    mixed = [shares[0], new[0], new[1]]
+    assert combine_key(mixed) == key
+    assert _pycryptodome_combine(mixed) == key
+
+
+def test_duplicate_shares_are_rejected():
+    shares = split_key(os.urandom(32), 2, 3)
+    with pytest.raises(ValueError):
+        combine_key([shares[0], shares[0]])
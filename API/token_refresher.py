@@ -0,0 +1,70 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from sqlalchemy import or_
+from storage import Storage, READABLE_STATUSES
+from storageController import StorageController
+import credential_cache
+
+TOKEN_REFRESHER_ENABLED = os.environ.get("TOKEN_REFRESHER_ENABLED", "1") == "1"
+REFRESH_INTERVAL = int(os.environ.get("TOKEN_REFRESH_INTERVAL", 60))  # seconds between sweeps
+REFRESH_AHEAD = int(os.environ.get("TOKEN_REFRESH_AHEAD", 600))  # refresh tokens expiring within this many seconds
+
+_stop = threading.Event()
+
+
+def refresh_due_tokens():
+    """
+    One sweep: refresh every google drive token that expires soon (or whose expiry we don't
+    know yet), put it in the credential cache and save it. Storages that fail to refresh are
+    flagged needs_relogin. Must run inside an app context.
+    """
+    cutoff = datetime.utcnow() + timedelta(seconds=REFRESH_AHEAD)
+    storages = Storage.query.filter(
+        Storage.storage_type == "google_drive",
+        Storage.status.in_(READABLE_STATUSES),
+        Storage.refresh_token.isnot(None),
+        or_(Storage.token_expiry.is_(None), Storage.token_expiry <= cutoff)
+    ).all()
+
+    dead = []
+    for storage in storages:
+        creds = StorageController.build_google_creds(storage)
+        try:
+            creds.refresh(Request())
+        except RefreshError as e:
+            print(f"Token refresh failed for storage {storage.storage_id}, needs re-login: {e}")
+            dead.append(storage.storage_id)
+            continue
+        except Exception as e:
+            # network trouble etc: try again next sweep
+            print(f"Error refreshing token for storage {storage.storage_id}: {e}")
+            continue
+        credential_cache.put_credentials(storage.storage_id, creds)
+
+    if dead:
+        StorageController.mark_needs_relogin(dead)
+    credential_cache.flush_tokens()
+
+
+def _run(app):
+    while not _stop.is_set():
+        with app.app_context():
+            try:
+                refresh_due_tokens()
+            except Exception as e:
+                print(f"Error in token refresher: {e}")
+        _stop.wait(REFRESH_INTERVAL)
+
+
+def start(app):
+    if not TOKEN_REFRESHER_ENABLED:
+        return
+    _stop.clear()
+    threading.Thread(target=_run, args=(app,), name="token-refresher", daemon=True).start()
+
+
+def stop():
+    _stop.set()
@@ -0,0 +1,151 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from flask import current_app
+
+# global limit: total number of remote transfers running at once across all requests
+MAX_WORKERS = int(os.environ.get("TRANSFER_MAX_WORKERS", 32))
+# per-request limit: how many transfers a single upload/download may have in flight
+PER_REQUEST_LIMIT = int(os.environ.get("TRANSFER_PER_REQUEST_LIMIT", 8))
+# seconds to wait on a slow backend before sending a hedged request to a spare
+HEDGE_DELAY = float(os.environ.get("TRANSFER_HEDGE_DELAY", 2.0))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="transfer")
+
+
+class TransferError(Exception):
+    """Raised when a transfer task fails; keeps track of the tasks that did finish."""
+
+    def __init__(self, label, error, results, group=None):
+        super().__init__(f"{label}: {error}")
+        self.label = label
+        self.error = error
+        self.results = results  # {position: result} for every task that succeeded
+        self.group = group  # which group ran out of tasks (first_k only)
+
+
+def _with_app_context(app, fn):
+    # worker threads don't inherit the request's app context (needed for database queries)
+    def run():
+        with app.app_context():
+            return fn()
+
+    return run
+
+
+def submit(fn, executor=None):
+    """Run fn on the shared transfer pool (or executor) inside the current app context."""
+    app = current_app._get_current_object()
+    return (executor or _executor).submit(_with_app_context(app, fn))
+
+
+def run_all(tasks, limit=None, executor=None):
+    """
+    Run (label, fn) tasks on the shared pool with at most `limit` of them in flight.
+    Returns the results in the same order as tasks. If a task fails, nothing new is
+    started, the running ones are allowed to finish, and TransferError is raised.
+    Tasks that themselves wait on the shared pool must get an executor of their own:
+    holding its workers while waiting for it can deadlock.
+    """
+    limit = max(1, limit or PER_REQUEST_LIMIT)
+    pending = list(enumerate(tasks))
+    pending.reverse()
+    running = {}
+    results = {}
+    failure = None
+
+    while pending or running:
+        while pending and failure is None and len(running) < limit:
+            position, (label, fn) = pending.pop()
+            running[submit(fn, executor)] = (position, label)
+
+        if not running:
+            break
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            position, label = running.pop(future)
+            try:
+                results[position] = future.result()
+            except Exception as e:
+                if failure is None:
+                    failure = (label, e)
+
+    if failure is not None:
+        raise TransferError(failure[0], failure[1], results)
+
+    return [results[i] for i in range(len(tasks))]
+
+
+def first_k(groups, hedge_delay=None):
+    """
+    Race groups of (label, fn) tasks where each group only needs k of them to succeed,
+    e.g. [(shard_tasks, required_shards), (key_tasks, key_threshold)].
+
+    Every group starts with k tasks. A spare is started whenever a task fails, and a
+    hedged request goes to a spare when nothing has finished for hedge_delay seconds.
+    As soon as a group has k results, its leftover tasks are cancelled (the ones already
+    running are abandoned). Returns one list of (position, result) per group, in the
+    order they finished, or raises TransferError when a group runs out of tasks.
+    """
+    hedge_delay = HEDGE_DELAY if hedge_delay is None else hedge_delay
+    states = []
+    for group, (tasks, k) in enumerate(groups):
+        spares = list(enumerate(tasks))
+        spares.reverse()
+        states.append({"group": group, "spares": spares, "k": k, "results": [], "running": {}, "errors": []})
+
+    def launch(state):
+        position, (label, fn) = state["spares"].pop()
+        future = submit(fn)
+        state["running"][future] = (position, label)
+        owner[future] = state
+
+    def finished(state):
+        return len(state["results"]) >= state["k"]
+
+    owner = {}
+    for state in states:
+        while state["spares"] and len(state["running"]) < state["k"]:
+            launch(state)
+
+    try:
+        while not all(finished(state) for state in states):
+            for state in states:
+                needed = state["k"] - len(state["results"])
+                if not finished(state) and len(state["running"]) < needed and not state["spares"]:
+                    label, error = state["errors"][-1] if state["errors"] else ("transfer", "not enough tasks")
+                    raise TransferError(label, error, dict(state["results"]), group=state["group"])
+
+            done, _ = wait(owner, timeout=hedge_delay, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # nothing finished in time: hedge every group that is still waiting
+                for state in states:
+                    if not finished(state) and state["spares"]:
+                        launch(state)
+                continue
+
+            for future in done:
+                state = owner.pop(future)
+                position, label = state["running"].pop(future)
+                if finished(state):
+                    continue
+                try:
+                    state["results"].append((position, future.result()))
+                except Exception as e:
+                    print(f"{label}: {e}")
+                    state["errors"].append((label, e))
+                    if state["spares"]:
+                        launch(state)
+
+            for state in states:
+                if finished(state):
+                    for future in state["running"]:
+                        future.cancel()
+                        owner.pop(future, None)
+                    state["running"].clear()
+    finally:
+        for future in owner:
+            future.cancel()
+
+    return [state["results"][:state["k"]] for state in states]
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import time
+from job_queue import Job, JobQueue
+
+UPLOAD_JOB_WORKERS = int(os.environ.get("UPLOAD_JOB_WORKERS", 4))
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or tempfile.gettempdir()
+
+
+class UploadJob(Job):
+    """Background upload with per-shard progress: spooled -> encoding -> uploading -> done."""
+
+    def __init__(self, filename, total_bytes):
+        super().__init__()
+        self.filename = filename
+        self.total_bytes = total_bytes
+        self.stage = "spooled"
+        self.encoded_bytes = 0
+        self.encode_started_at = None
+        self.upload_started_at = None
+        self.objects = {}  # (kind, index) -> {"size": ..., "done": bool}
+
+    def set_stage(self, stage, objects=None):
+        with self.lock:
+            self.stage = stage
+            if stage == "encoding":
+                self.encode_started_at = time.time()
+            elif stage == "uploading":
+                self.upload_started_at = time.time()
+                self.objects = {(kind, index): {"size": size, "done": False} for kind, index, size in objects}
+
+    def add_encoded(self, byte_count):
+        with self.lock:
+            self.encoded_bytes += byte_count
+
+    def object_done(self, kind, index):
+        with self.lock:
+            if (kind, index) in self.objects:
+                self.objects[(kind, index)]["done"] = True
+
+    def to_dict(self):
+        with self.lock:
+            data = super().to_dict()
+            now = self.finished_at or time.time()
+            uploaded = sum(o["size"] for o in self.objects.values() if o["done"])
+            upload_seconds = now - self.upload_started_at if self.upload_started_at else 0
+            encode_seconds = (self.upload_started_at or now) - self.encode_started_at if self.encode_started_at else 0
+            data.update({
+                "filename": self.filename,
+                "stage": "done" if self.status == "done" else self.stage,
+                "total_bytes": self.total_bytes,
+                "encoded_bytes": self.encoded_bytes,
+                "encode_throughput": self.encoded_bytes / encode_seconds if encode_seconds else None,
+                "uploaded_bytes": uploaded,
+                "upload_throughput": uploaded / upload_seconds if upload_seconds else None,
+                "shards": [
+                    {"index": index, "size": o["size"], "done": o["done"]}
+                    for (kind, index), o in sorted(self.objects.items()) if kind == "shard"
+                ],
+                "key_shares": [
+                    {"index": index, "done": o["done"]}
+                    for (kind, index), o in sorted(self.objects.items()) if kind == "key"
+                ]
+            })
+            return data
+
+
+class UploadJobs:
+    queue = JobQueue("upload-job", UPLOAD_JOB_WORKERS)
+
+    @staticmethod
+    def submit(file, params, pipeline):
+        """
+        Spool the uploaded file to disk and run pipeline(stream, filename, params, progress)
+        (FileController.store_file) on a background worker. Returns the job right away.
+        """
+        fd, spool_path = tempfile.mkstemp(prefix="upload-", dir=UPLOAD_SPOOL_DIR)
+        with os.fdopen(fd, "wb") as spool:
+            file.save(spool)
+        job = UploadJob(file.filename, os.path.getsize(spool_path))
+
+        def run(job):
+            with open(spool_path, "rb") as stream:
+                return pipeline(stream, job.filename, params, progress=job)
+
+        def cleanup():
+            os.remove(spool_path)
+
+        return UploadJobs.queue.submit(job, run, cleanup)
+
+    @staticmethod
+    def get(job_id):
+        return UploadJobs.queue.get(job_id)
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import time
+from uuid import uuid4
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from segment_codec import SegmentEncoder
+import codec_executor
+from upload_jobs import UPLOAD_SPOOL_DIR
+
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))  # idle seconds before a session is dropped
+CHUNK_READ_SIZE = 1024 * 1024
+
+
+class OffsetMismatch(Exception):
+    def __init__(self, expected):
+        super().__init__(f"chunk offset must be {expected}")
+        self.expected = expected
+
+
+class UploadSession:
+    """
+    A resumable upload in progress. Every chunk goes straight into the segment encoder, so the
+    server-side spool is the n encrypted shard files; only the unfinished last segment stays in memory.
+    """
+
+    def __init__(self, filename, params, total_size=None):
+        self.upload_id = uuid4().hex
+        self.filename = filename
+        self.params = params
+        self.total_size = total_size
+        self.key = AESGCM.generate_key(bit_length=256)
+        self.shard_sinks = [tempfile.TemporaryFile(dir=UPLOAD_SPOOL_DIR) for _ in range(params["n"])]
+        self.encoder = SegmentEncoder(self.key, params["k"], params["n"], self.shard_sinks,
+                                      encode=codec_executor.encode_segment, compression=params.get("compression"))
+        self.lock = threading.Lock()
+        self.last_active = time.time()
+
+    @property
+    def received(self):
+        return self.encoder.total_length
+
+    def append(self, offset, stream):
+        """
+        Feed a chunk that starts at `offset`. A retried chunk that overlaps what we already have
+        is fine (the overlap is skipped); a gap raises OffsetMismatch. Returns the new offset.
+        """
+        with self.lock:
+            self.last_active = time.time()
+            if offset > self.received:
+                raise OffsetMismatch(self.received)
+
+            skip = self.received - offset
+            while True:
+                chunk = stream.read(CHUNK_READ_SIZE)
+                if not chunk:
+                    break
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk = chunk[dropped:]
+                    skip -= dropped
+                if chunk:
+                    self.encoder.feed(chunk)
+            return self.received
+
+    def finish(self):
+        with self.lock:
+            return self.encoder.finish()
+
+    def close(self):
+        for sink in self.shard_sinks:
+            sink.close()
+
+
+class UploadSessions:
+    _sessions = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def create(filename, params, total_size=None):
+        session = UploadSession(filename, params, total_size)
+        with UploadSessions._lock:
+            UploadSessions._prune()
+            UploadSessions._sessions[session.upload_id] = session
+        return session
+
+    @staticmethod
+    def get(upload_id):
+        with UploadSessions._lock:
+            return UploadSessions._sessions.get(upload_id)
+
+    @staticmethod
+    def pop(upload_id):
+        with UploadSessions._lock:
+            return UploadSessions._sessions.pop(upload_id, None)
+
+    @staticmethod
+    def _prune():
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        for upload_id, session in list(UploadSessions._sessions.items()):
+            if session.last_active < cutoff:
+                del UploadSessions._sessions[upload_id]
+                session.close()
@@ -0,0 +1,137 @@
+"""
+Streaming ZIP archives of stored files.
+
+The archive is written with zipfile onto a write-only sink, which makes zipfile use data
+descriptors (sizes and CRC after each file's data), so nothing has to be seeked back to and
+every byte can be sent as soon as it's written. Files are stored uncompressed: they're often
+compressed already, and the archive stays a straight copy of the decrypted bytes.
+
+Up to ZIP_CONCURRENT_FILES files are reconstructed ahead at once, each into a queue of at most
+ZIP_BUFFERED_CHUNKS chunks (segments), so memory stays bounded however large the export is,
+and the files still go into the archive in order.
+"""
+import os
+import queue
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+from flask import current_app
+
+ZIP_CONCURRENT_FILES = int(os.environ.get("ZIP_CONCURRENT_FILES", 4))  # per archive
+ZIP_BUFFERED_CHUNKS = int(os.environ.get("ZIP_BUFFERED_CHUNKS", 4))  # per file being read ahead
+ZIP_WORKERS = int(os.environ.get("ZIP_WORKERS", 8))  # readers across all archives
+
+# readers wait on the transfer pool themselves, so they get their own threads
+_executor = ThreadPoolExecutor(max_workers=ZIP_WORKERS, thread_name_prefix="zip")
+
+
+@dataclass
+class ZipEntry:
+    name: str
+    size: int
+    modified: datetime
+    open: Callable  # () -> iterator of the file's bytes; may raise before the first one
+
+
+class _Sink:
+    """Write-only file object collecting what zipfile writes until the generator sends it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def _read_ahead(app, entry, chunks, cancelled):
+    def put(item):
+        # give up once the client is gone instead of blocking on a queue nobody reads
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    with app.app_context():
+        try:
+            for chunk in entry.open():
+                if chunk and not put(("data", chunk)):
+                    return
+            put(("done", None))
+        except Exception as e:
+            put(("error", e))
+
+
+def _archive_name(name, used):
+    # no directories (or ../) inside the archive, and no two entries with the same name
+    name = name.replace("/", "_").replace("\\", "_").lstrip(".") or "file"
+    stem, ext = os.path.splitext(name)
+    candidate, number = name, 1
+    while candidate in used:
+        number += 1
+        candidate = f"{stem} ({number}){ext}"
+    used.add(candidate)
+    return candidate
+
+
+def stream_zip(entries):
+    """
+    Generator of a ZIP archive of entries (ZipEntry). Files that can't be read are left out and
+    listed in ERRORS.txt at the end of the archive (the status code is long gone by then).
+    Must be iterated inside an app context (e.g. through stream_with_context).
+    """
+    app = current_app._get_current_object()
+    cancelled = threading.Event()
+    pending = {}
+    sink = _Sink()
+    used_names = set()
+    errors = []
+
+    def read_ahead(i):
+        if i < len(entries):
+            pending[i] = queue.Queue(maxsize=ZIP_BUFFERED_CHUNKS)
+            _executor.submit(_read_ahead, app, entries[i], pending[i], cancelled)
+
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for i in range(ZIP_CONCURRENT_FILES):
+                read_ahead(i)
+
+            for i, entry in enumerate(entries):
+                chunks = pending.pop(i)
+                kind, value = chunks.get()
+                if kind == "error":
+                    errors.append(f"{entry.name}: {value}")
+                else:
+                    info = zipfile.ZipInfo(_archive_name(entry.name, used_names),
+                                           date_time=max(entry.modified, datetime(1980, 1, 1)).timetuple()[:6])
+                    info.compress_type = zipfile.ZIP_STORED
+                    info.file_size = entry.size  # lets zipfile decide on zip64 up front
+                    with archive.open(info, "w") as member:
+                        while kind == "data":
+                            member.write(value)
+                            yield from sink.drain()
+                            kind, value = chunks.get()
+                    if kind == "error":
+                        errors.append(f"{entry.name}: incomplete, {value}")
+                read_ahead(i + ZIP_CONCURRENT_FILES)
+                yield from sink.drain()
+
+            if errors:
+                archive.writestr("ERRORS.txt", "\n".join(errors) + "\n")
+        yield from sink.drain()
+    finally:
+        cancelled.set()